@@ -0,0 +1,262 @@
+""" Throughput benchmarks for the Enigma machine.
+
+Measures letters per second for step(), encrypt_msg and the compiled and
+bulk paths over a few representative keys, plus machine construction time
+and memory, and reconfiguration and snapshot restore latency. Results can be
+saved as a JSON baseline and later runs compared against it.
+
+Each result is the median of several samples, and every sample runs its
+benchmark for at least a minimum time, so one slow run does not fail the
+comparison. A baseline records whether it was made with --quick and is only
+compared with runs made the same way.
+
+    python bench.py                          run and print
+    python bench.py --save baseline.json     record a baseline
+    python bench.py --compare baseline.json  exit 1 on a regression
+"""
+
+import argparse
+import json
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+
+import enigma
+from enigma import EnigmaMachine, MachineConfig
+
+FULL_PLUGBOARD = (("A", "Q"), ("B", "J"), ("C", "X"), ("D", "L"), ("E", "M"),
+                  ("F", "Y"), ("G", "T"), ("H", "O"), ("I", "W"), ("K", "U"))
+
+CONFIGS = {
+    "plain-b": MachineConfig((1, 2, 3), "AAA", "AAA", "UKW-B", ()),
+    "full-plugboard-c": MachineConfig((3, 4, 5), "AKF", "CJH", "UKW-C", FULL_PLUGBOARD),
+    # Middle rotor one before its notch, right rotor one before its notch:
+    # the first keypresses double step.
+    "double-step-b": MachineConfig((1, 2, 3), "AAA", "ADU", "UKW-B", FULL_PLUGBOARD[:5]),
+}
+
+
+def setup(config):
+    machine = EnigmaMachine()
+    machine.apply(config)
+    return machine
+
+
+# Samples per result and the least time each sample runs for, in seconds
+MODES = {
+    "quick": {"samples": 5, "min_time": 0.05},
+    "full": {"samples": 7, "min_time": 0.5},
+}
+
+
+def median_time(func, mode, prepare=None):
+    """ Median seconds per call of func(). Each sample calls func until
+    min_time has passed. prepare() is called untimed before every call and
+    its result is passed to func. """
+    settings = MODES[mode]
+    samples = []
+    for i in range(settings["samples"]):
+        calls = 0
+        took = 0.0
+        while took < settings["min_time"] or calls == 0:
+            arg = prepare() if prepare is not None else None
+            start = time.perf_counter()
+            if prepare is not None:
+                func(arg)
+            else:
+                func()
+            took += time.perf_counter() - start
+            calls += 1
+        samples.append(took / calls)
+    return statistics.median(samples)
+
+
+def throughput(config, size, run, mode):
+    """ Letters per second of run(machine, text), on a fresh machine for
+    every call. Compiled tables come from the shared cache, so every call
+    after the first is measured with warm tables. """
+    rng = random.Random(0)
+    text = "".join(rng.choice(enigma.ALPHABET) for i in range(size))
+
+    took = median_time(lambda machine: run(machine, text), mode, prepare=lambda: setup(config))
+    return {"value": size / took, "unit": "letters/s", "higher_is_better": True}
+
+
+def run_step(machine, text):
+    for letter in text:
+        machine.step(letter)
+
+
+def run_step_compiled(machine, text):
+    machine.set_compiled(True)
+    for letter in text:
+        machine.step(letter)
+
+
+def run_encrypt_msg(machine, text):
+    machine.vector_threshold = len(text) + 1
+    machine.encrypt_msg(text)
+
+
+def run_encrypt_msg_vectorized(machine, text):
+    machine.vector_threshold = 0
+    machine.encrypt_msg(text)
+
+
+def run_encrypt_chunk(machine, text):
+    machine.encrypt_chunk(text.encode("ascii"))
+
+
+def run_encrypt_bytes_into(machine, text):
+    buf = bytearray(text.encode("ascii"))
+    machine.encrypt_bytes(buf, into=buf)
+
+
+def benchmarks(mode="full"):
+    """ Name -> result dict for every benchmark. mode is "quick" or "full". """
+    if mode not in MODES:
+        raise ValueError("mode must be one of {}".format(", ".join(MODES)))
+    quick = mode == "quick"
+    small = 2000 if quick else 20000
+    large = 100000 if quick else 2000000
+
+    paths = [
+        ("step", run_step, small),
+        ("step-compiled", run_step_compiled, small),
+        ("encrypt_msg", run_encrypt_msg, small),
+    ]
+    if enigma.np is not None:
+        paths += [
+            ("encrypt_msg-vectorized", run_encrypt_msg_vectorized, large),
+            ("encrypt_chunk", run_encrypt_chunk, large),
+            ("encrypt_bytes-into", run_encrypt_bytes_into, large),
+        ]
+
+    results = {}
+    for config_name, config in CONFIGS.items():
+        for path_name, run, size in paths:
+            results["{}/{}".format(path_name, config_name)] = throughput(config, size, run, mode)
+
+    count = 200 if quick else 2000
+    took = median_time(lambda: [EnigmaMachine() for i in range(count)], mode)
+    results["construct"] = {"value": took / count, "unit": "s", "higher_is_better": False}
+
+    tracemalloc.start()
+    machines = [EnigmaMachine() for i in range(count)]
+    used = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del machines
+    results["machine-memory"] = {"value": used / count, "unit": "bytes", "higher_is_better": False}
+
+    machine = EnigmaMachine()
+    configs = list(CONFIGS.values())
+
+    def reconfigure():
+        for i in range(count):
+            config = configs[i % len(configs)]
+            machine.reset_plugboard()
+            machine.set_sockets(list(config.rotors))
+            machine.set_reflector(config.reflector)
+            for j in range(3):
+                machine.set_rotor_ringstellung(j + 1, config.ringstellung[j])
+                machine.set_rotor_initial_offset(j + 1, config.offsets[j])
+            for let_1, let_2 in config.plugboard:
+                machine.create_plugboard_pair(let_1, let_2)
+            machine.compile()
+
+    took = median_time(reconfigure, mode)
+    results["reconfigure"] = {"value": took / count, "unit": "s", "higher_is_better": False}
+
+    def apply():
+        for i in range(count):
+            machine.apply(configs[i % len(configs)])
+            machine.compile()
+
+    took = median_time(apply, mode)
+    results["apply"] = {"value": took / count, "unit": "s", "higher_is_better": False}
+
+    snap = machine.snapshot()
+
+    def branch():
+        for i in range(count):
+            machine.rotate_rotors()
+            machine.restore(snap)
+
+    took = median_time(branch, mode)
+    results["restore"] = {"value": took / count, "unit": "s", "higher_is_better": False}
+    return results
+
+
+def load_baseline(path, mode):
+    """ Results saved by --save. Raises ValueError if the file was made in
+    another mode, since quick and full runs are not comparable. """
+    with open(path) as f:
+        saved = json.load(f)
+    if not isinstance(saved, dict) or "mode" not in saved or "results" not in saved:
+        raise ValueError("{} has no mode, record it again with --save".format(path))
+    if saved["mode"] != mode:
+        raise ValueError("{} was recorded in {} mode, this run is {}. Run both the same way"
+                         .format(path, saved["mode"], mode))
+    return saved["results"]
+
+
+def compare(results, baseline, threshold):
+    """ Names of benchmarks whose median is more than threshold (a fraction)
+    worse than baseline. """
+    regressions = []
+    for name, base in baseline.items():
+        if name not in results:
+            continue
+        value = results[name]["value"]
+        if base["higher_is_better"]:
+            worse = value < base["value"] * (1 - threshold)
+        else:
+            worse = value > base["value"] * (1 + threshold)
+        if worse:
+            regressions.append(name)
+    return regressions
+
+
+def show(results, baseline=None):
+    for name, result in results.items():
+        line = "{:45} {:>14.6g} {}".format(name, result["value"], result["unit"])
+        if baseline is not None and name in baseline:
+            change = result["value"] / baseline[name]["value"] - 1
+            line += "   {:+.1%} vs baseline".format(change)
+        print(line)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Enigma machine benchmarks")
+    parser.add_argument("--quick", action="store_true", help="smaller inputs and shorter samples")
+    parser.add_argument("--save", metavar="FILE", help="write results to FILE as a JSON baseline")
+    parser.add_argument("--compare", metavar="FILE", help="compare against a JSON baseline, exit 1 on regression")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed slowdown as a fraction (default 0.2)")
+    args = parser.parse_args()
+
+    mode = "quick" if args.quick else "full"
+    baseline = None
+    if args.compare:
+        try:
+            baseline = load_baseline(args.compare, mode)
+        except (OSError, ValueError) as err:
+            sys.exit("Error: {}".format(err))
+
+    results = benchmarks(mode)
+    show(results, baseline)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({"mode": mode, "results": results}, f, indent=2, sort_keys=True)
+        print("Baseline written to {}".format(args.save))
+
+    if baseline is not None:
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print("Regressions beyond {:.0%}:".format(args.threshold))
+            for name in regressions:
+                print("  " + name)
+            sys.exit(1)
+        print("No regressions beyond {:.0%}".format(args.threshold))
@@ -0,0 +1,208 @@
+""" Turing-Welchman style bombe. Known plaintext (crib) attack on the M3.
+
+A crib is a guess at the plaintext of part of a message. Each crib letter and
+the cipher letter under it are joined by the scrambler (rotors and reflector,
+no plugboard) at that keypress. Together they form the menu: a graph on the
+letters with one edge per keypress.
+
+For a rotor order and start position the bombe guesses the plugboard partner
+of the busiest menu letter and follows the menu edges through the scramblers.
+Each edge gives the partner of the next letter. If two edges disagree, or two
+letters claim the same partner, the guess is wrong. A guess that survives the
+whole menu is a stop, and the partners it implies are the plugboard pairs.
+
+Every start position and every guess is tested at once with numpy, using the
+compiled scrambler tables, and contradicted rows are dropped after each edge.
+"""
+
+import itertools
+from collections import namedtuple
+
+import numpy as np
+
+from enigma import EnigmaMachine, ALPHABET, odometer
+
+# Rotor order (socket 1, 2, 3), reflector name, message start offsets like "ADU",
+# and the plugboard pairs implied by the stop.
+Stop = namedtuple("Stop", ["rotors", "reflector", "position", "plugboard"])
+
+
+def clean(text):
+    """ Uppercase letters only. Spaces are dropped like in encrypt_msg. """
+    text = text.replace(" ", "").upper()
+    if not text.isalpha() or not text.isascii():
+        raise ValueError("text must be alphabetic only")
+    return text
+
+
+def make_menu(ciphertext, crib, offset=0):
+    """ Menu edges (crib letter, cipher letter, keypress) as letter numbers.
+    keypress counts from 1 at the start of the message. """
+    ciphertext = clean(ciphertext)
+    crib = clean(crib)
+    if offset < 0 or offset + len(crib) > len(ciphertext):
+        raise ValueError("crib does not fit in ciphertext at offset {}".format(offset))
+
+    edges = []
+    for i in range(len(crib)):
+        p = crib[i]
+        c = ciphertext[offset + i]
+        if p == c:
+            raise ValueError("crib cannot be placed at offset {}: '{}' would encrypt to itself".format(offset, p))
+        edges.append((ord(p) - 65, ord(c) - 65, offset + i + 1))
+    return edges
+
+
+def menu_order(edges):
+    """ Picks the test letter (most edges) and orders the edges of its
+    connected part breadth first, so the start of every edge is known by the
+    time it is reached. Edges closing a loop come as soon as possible, which is
+    where the pruning happens. """
+    degree = [0] * 26
+    for a, b, i in edges:
+        degree[a] += 1
+        degree[b] += 1
+    test = max(range(26), key=lambda x: degree[x])
+
+    ordered = []
+    known = {test}
+    queue = [test]
+    used = set()
+    while queue:
+        x = queue.pop(0)
+        for n, (a, b, i) in enumerate(edges):
+            if n in used or x not in (a, b):
+                continue
+            used.add(n)
+            if a != x:
+                a, b = b, a
+            ordered.append((a, b, i))
+            if b not in known:
+                known.add(b)
+                queue.append(b)
+
+    return test, ordered
+
+
+def scrambler_tables(order, reflector, rings="AAA"):
+    """ (17576, 26) uint8 array of scrambler substitutions (no plugboard) per rotor position. """
+    machine = EnigmaMachine()
+    # Attacks go through every rotor order. Keep their full tables out of the
+    # cache that machines in this process share.
+    machine.cache = None
+    machine.set_sockets(list(order))
+    machine.set_reflector(reflector)
+    for i in range(3):
+        machine.set_rotor_ringstellung(i + 1, rings[i])
+    return machine, machine.compile().array()
+
+
+def search_order(order, reflector, test, ordered, rings="AAA"):
+    """ Runs the bombe for one rotor order and reflector. Returns stops. """
+    machine, table = scrambler_tables(order, reflector, rings)
+    nm = machine.sockets[2].notch_nums[0]
+    nr = machine.sockets[3].notch_nums[0]
+
+    # Every start position, with every guess for the test letter's partner
+    starts = np.arange(17576)
+    l0, m0, r0 = starts // 676, starts // 26 % 26, starts % 26
+
+    # Rotor position at each menu keypress, for every start position
+    positions = {}
+    for a, b, i in ordered:
+        if i not in positions:
+            l, m, r = odometer(l0, m0, r0, nm, nr, i)
+            positions[i] = l * 676 + m * 26 + r
+
+    row_start = np.repeat(starts, 26)
+    partner = {test: np.tile(np.arange(26, dtype=np.uint8), 17576)}
+
+    for a, b, i in ordered:
+        # Partner of b is the scrambler output for the partner of a
+        out = table[positions[i][row_start], partner[a]]
+
+        if b in partner:
+            keep = partner[b] == out
+        else:
+            # b's partner must not be claimed already, and pairs must be mutual
+            keep = np.ones(len(row_start), dtype=bool)
+            for c, val in partner.items():
+                keep &= val != out
+                keep &= (out != c) | (val == b)
+                keep &= (val != b) | (out == c)
+            # b may be unplugged, but then nobody else can claim b
+            partner[b] = out
+
+        row_start = row_start[keep]
+        for c in partner:
+            partner[c] = partner[c][keep]
+        if len(row_start) == 0:
+            return []
+
+    stops = []
+    for n in range(len(row_start)):
+        start = int(row_start[n])
+        pairs = sorted(set(
+            tuple(sorted((ALPHABET[c], ALPHABET[int(val[n])])))
+            for c, val in partner.items() if int(val[n]) != c))
+        position = ALPHABET[start // 676] + ALPHABET[start // 26 % 26] + ALPHABET[start % 26]
+        stops.append(Stop(tuple(order), reflector, position, pairs))
+    return stops
+
+
+def search(ciphertext, crib, offset=0, orders=None, reflectors=("UKW-B", "UKW-C"), rings="AAA"):
+    """ Tests every rotor order (default: all 60 orders of three from the five
+    rotors), reflector and start position against a crib placed at offset in
+    the ciphertext. Returns the stops. Stop.position is the rotor position at
+    the start of the message, before the first keypress. The ring settings
+    are taken as given by rings. A wrong ring setting only matters if the
+    middle rotor turns over inside the crib. """
+    edges = make_menu(ciphertext, crib, offset)
+    test, ordered = menu_order(edges)
+
+    if orders is None:
+        orders = list(itertools.permutations(EnigmaMachine().r_table.keys(), 3))
+
+    stops = []
+    for order in orders:
+        for reflector in reflectors:
+            stops.extend(search_order(order, reflector, test, ordered, rings))
+    return stops
+
+
+def machine_for(stop, rings="AAA"):
+    """ EnigmaMachine set up from a stop, at the start of the message. """
+    machine = EnigmaMachine()
+    machine.set_sockets(list(stop.rotors))
+    machine.set_reflector(stop.reflector)
+    for i in range(3):
+        machine.set_rotor_ringstellung(i + 1, rings[i])
+        machine.set_rotor_initial_offset(i + 1, stop.position[i])
+    for let_1, let_2 in stop.plugboard:
+        machine.create_plugboard_pair(let_1, let_2)
+    return machine
+
+
+if __name__ == "__main__":
+    import time
+
+    # Encrypt a message with a known key, then find it again from a crib.
+    e = EnigmaMachine()
+    e.set_sockets([2, 5, 3])
+    e.set_reflector("UKW-B")
+    e.set_rotor_initial_offset(1, "R")
+    e.set_rotor_initial_offset(2, "D")
+    e.set_rotor_initial_offset(3, "K")
+    for pair in ("AQ", "BJ", "CX", "EM", "GT"):
+        e.create_plugboard_pair(pair[0], pair[1])
+
+    plain = "WETTERVORHERSAGEBISKAYAXXNEBELIMOSTENKEINEANGRIFFE"
+    cipher = e.encrypt_msg(plain)
+    crib = "WETTERVORHERSAGEBISKAYA"
+
+    start = time.time()
+    stops = search(cipher, crib)
+    print("Searched 60 rotor orders, 2 reflectors in {:.1f}s. {} stops".format(time.time() - start, len(stops)))
+    for stop in stops:
+        print(stop)
+    print(any(s.rotors == (2, 5, 3) and s.position == "RDK" for s in stops))
@@ -0,0 +1,86 @@
+""" Bounded LRU cache of compiled machine tables.
+
+Keys are configuration fingerprints (EnigmaMachine.fingerprint(), the same as
+MachineConfig.tables_key()), values are CompiledTables. Size is counted in
+bytes with CompiledTables.nbytes(). That grows as lazy tables fill in and
+when the full array is built, so cached tables report their growth with
+grew() and the cap is checked again then, not only on insert.
+"""
+
+from collections import OrderedDict
+
+
+class TablesCache():
+
+    def __init__(self, max_bytes=64 << 20):
+        if max_bytes < 0:
+            raise ValueError("max_bytes cannot be negative")
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def get(self, key, build):
+        """ Returns the cached tables for key, calling build() to make them on a miss. """
+        tables = self.entries.get(key)
+        if tables is not None:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return tables
+
+        self.misses += 1
+        tables = build()
+        tables.cache = self
+        self.entries[key] = tables
+        self.size += tables.nbytes()
+        self.trim()
+        return tables
+
+    def grew(self, nbytes):
+        """ Called by cached tables that grew by nbytes. """
+        self.size += nbytes
+        if self.size > self.max_bytes:
+            self.trim()
+
+    def trim(self):
+        """ Drops least recently used entries until the cache fits in max_bytes.
+        The newest entry is kept even if it is larger than the cap on its own. """
+        while self.size > self.max_bytes and len(self.entries) > 1:
+            key, tables = self.entries.popitem(last=False)
+            self.drop(tables)
+            self.evictions += 1
+
+    def drop(self, tables):
+        # Machines may still use dropped tables, they just stop counting here.
+        tables.cache = None
+        self.size -= tables.nbytes()
+
+    def invalidate(self, key=None):
+        """ Drops one key, or everything when key is None. """
+        if key is None:
+            for tables in self.entries.values():
+                self.drop(tables)
+            self.entries.clear()
+        elif key in self.entries:
+            self.drop(self.entries.pop(key))
+
+    def nbytes(self):
+        return self.size
+
+    def stats(self):
+        return {
+            "entries": len(self.entries),
+            "bytes": self.nbytes(),
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions
+        }
@@ -0,0 +1,159 @@
+""" Crib dragging. Finds where a crib can sit in a ciphertext.
+
+An Enigma never encrypts a letter to itself, so a crib cannot be placed
+where any of its letters is over the same cipher letter. For each crib
+letter the whole ciphertext is compared at once with numpy, so every offset
+is tested in len(crib) array operations.
+
+The admissible placements are ranked by the loops in their menu (see
+bombe.py). Every loop is a check the bombe can use to reject a wrong rotor
+position, so placements with more loops give fewer false stops.
+"""
+
+from collections import namedtuple
+
+import numpy as np
+
+import bombe
+from bombe import clean
+from ioc import to_codes
+
+# crib is the cleaned crib text, offset its position in the cleaned
+# ciphertext (spaces removed), loops the number of loops in its menu.
+Placement = namedtuple("Placement", ["crib", "offset", "loops"])
+
+
+def admissible(codes, crib):
+    """ Boolean array with one entry per offset (0 to len(codes) - len(crib)),
+    True where no crib letter is over the same cipher letter. codes and crib
+    are arrays of letter numbers. """
+    n, m = len(codes), len(crib)
+    if m == 0:
+        raise ValueError("crib cannot be empty")
+    if m > n:
+        return np.zeros(0, dtype=bool)
+
+    ok = np.ones(n - m + 1, dtype=bool)
+    for i in range(m):
+        ok &= codes[i:i + n - m + 1] != crib[i]
+    return ok
+
+
+def menu_loops(crib, windows):
+    """ Loops in the menu part that the bombe follows (the connected part of
+    the test letter, see bombe.menu_order) for many placements at once. crib
+    is an array of letter numbers and windows a (placements, len(crib)) array
+    of the cipher letters under it. The loops of a connected part are its
+    edges minus its letters plus one. Returns an array. """
+    count = len(windows)
+    rows = np.arange(count)
+    bit = np.left_shift(np.uint32(1), np.arange(26, dtype=np.uint32))
+
+    # Edges per letter, and the neighbours of each letter as a bit mask
+    degree = np.zeros((count, 26), dtype=np.int32)
+    links = np.zeros((count, 26), dtype=np.uint32)
+    for j in range(len(crib)):
+        c, w = crib[j], windows[:, j]
+        degree[:, c] += 1
+        degree[rows, w] += 1
+        links[:, c] |= bit[w]
+        links[rows, w] |= bit[c]
+
+    # Test letter: most edges, lowest letter on a tie, like menu_order.
+    # Its part is spread along the links until nothing changes.
+    reach = bit[degree.argmax(axis=1)]
+    while True:
+        grown = reach.copy()
+        for k in range(26):
+            grown |= np.where(reach & bit[k], links[:, k], np.uint32(0))
+        if np.array_equal(grown, reach):
+            break
+        reach = grown
+
+    edges = np.zeros(count, dtype=np.int32)
+    for j in range(len(crib)):
+        edges += (reach & bit[crib[j]]) != 0
+    letters = np.zeros(count, dtype=np.int32)
+    for k in range(26):
+        letters += (reach & bit[k]) != 0
+    return edges - letters + 1
+
+
+def find(ciphertext, cribs, min_loops=0, limit=None):
+    """ Every admissible placement of every crib in ciphertext with at least
+    min_loops menu loops. Best first: most loops, then longest crib, then
+    earliest offset. limit keeps only that many of the best. """
+    codes = to_codes(ciphertext)
+
+    found = []
+    for crib in cribs:
+        crib = clean(crib)
+        crib_codes = to_codes(crib)
+        if len(crib_codes) > len(codes):
+            # Cannot be placed anywhere
+            continue
+        offsets = np.nonzero(admissible(codes, crib_codes))[0]
+        windows = np.lib.stride_tricks.sliding_window_view(codes, len(crib))[offsets]
+        loops = menu_loops(crib_codes, windows)
+        keep = loops >= min_loops
+        found.append((crib, offsets[keep], loops[keep]))
+
+    if not found:
+        return []
+    # Rank everything with numpy and only make Placements for what is returned
+    crib_nums = np.concatenate([np.full(len(f[1]), i) for i, f in enumerate(found)])
+    offsets = np.concatenate([f[1] for f in found])
+    loops = np.concatenate([f[2] for f in found])
+    lengths = np.array([len(f[0]) for f in found])[crib_nums]
+    order = np.lexsort((offsets, -lengths, -loops))[:limit]
+    return [Placement(found[crib_nums[i]][0], int(offsets[i]), int(loops[i])) for i in order]
+
+
+def attack(ciphertext, placement, **kwargs):
+    """ Runs the bombe for one placement. kwargs go to bombe.search
+    (orders, reflectors, rings). Returns the stops. """
+    return bombe.search(ciphertext, placement.crib, placement.offset, **kwargs)
+
+
+def machine_at(stop, offset, rings="AAA"):
+    """ EnigmaMachine set up from a stop and moved on offset keypresses with
+    seek, ready to decrypt the ciphertext from offset onwards. """
+    machine = bombe.machine_for(stop, rings)
+    machine.seek(offset)
+    return machine
+
+
+if __name__ == "__main__":
+    import random
+    import time
+
+    from enigma import EnigmaMachine, ALPHABET
+
+    e = EnigmaMachine()
+    e.set_sockets([2, 5, 3])
+    e.set_rotor_initial_offset(1, "R")
+    e.set_rotor_initial_offset(2, "D")
+    e.set_rotor_initial_offset(3, "K")
+    for pair in ("AQ", "BJ", "CX", "EM", "GT"):
+        e.create_plugboard_pair(pair[0], pair[1])
+
+    rng = random.Random(3)
+    filler = "".join(rng.choice(ALPHABET) for i in range(20000))
+    plain = filler[:12345] + "WETTERVORHERSAGEBISKAYA" + filler[12345:]
+    cipher = e.encrypt_msg(plain)
+
+    start = time.time()
+    placements = find(cipher, ["WETTERVORHERSAGEBISKAYA", "KEINEBESONDERENEREIGNISSE"])
+    print("{} admissible placements in {:.2f}s".format(len(placements), time.time() - start))
+    print(placements[:3])
+
+    true = [p for p in placements if p.offset == 12345 and p.crib.startswith("WETTER")]
+    print(len(true) == 1)
+
+    stops = attack(cipher, true[0], orders=[(2, 5, 3)], reflectors=("UKW-B",))
+    print(stops)
+    print(any(s.position == "RDK" for s in stops))
+
+    # Plugboard pairs outside the menu are still missing, so a few letters may be off
+    machine = machine_at(stops[0], 12345)
+    print(machine.encrypt_msg(cipher[12345:12345 + 23]))
@@ -2,51 +2,454 @@
 # different rotor settings.
 
 import logging
-from rotor import Rotor
-from reflector import Reflector
+import mmap
+import multiprocessing
+import os
+import time
+from collections import namedtuple
+from rotor import Rotor, ALPHABET, LETTERS, LETTER_NUMS, WIRINGS
+from reflector import REFLECTORS
+from cache import TablesCache
+from profiling import StageProfiler
+
+# Reflector names in the order snapshot() numbers them.
+REFLECTOR_TYPES = ("UKW-B", "UKW-C")
+
+# Plugboard with no pairs, as a letter number permutation.
+NO_PAIRS = tuple(range(26))
+
+# Below this many bytes encrypt_bytes loops over table rows even when the full
+# table is built, since numpy's fixed cost per call is larger for short buffers.
+SMALL_BUFFER = 64
+
+try:
+    import numpy as np
+except ImportError:
+    # numpy is optional. Without it the vectorized paths are skipped.
+    np = None
+
+
+def odometer(left, mid, right, mid_notch, right_notch, n):
+    """ Rotor offsets after n keypresses, following the stepping of
+    EnigmaMachine.rotate_rotors (double-stepping included) for rotors with a
+    single notch. Uses plain arithmetic only, so n (or the offsets) may be
+    numpy arrays, in which case every element is computed at once. """
+
+    # Middle rotor sitting on its notch steps all three rotors on the first press.
+    f = (mid == mid_notch) * (n >= 1)
+    left = left + f
+    mid = mid + f
+    right = right + f
+    n = n - f
+
+    # k: presses that start with the right rotor on its notch. First one is press t0.
+    t0 = (right_notch - right) % 26 + 1
+    k = (n - t0) // 26 + 1
+
+    # The middle rotor lands on its notch after d of those presses and then every
+    # 25 more. Each landing is followed by a double step on the next press,
+    # unless the landing was the very last press.
+    d = (mid_notch - mid - 1) % 26 + 1
+    landings = ((k - d) // 25 + 1) * (k >= d)
+    last = (landings >= 1) * (k == d + 25 * (landings - 1)) * (t0 + 26 * (k - 1) == n)
+    double_steps = landings - last
+
+    return (left + double_steps) % 26, (mid + k + double_steps) % 26, (right + n) % 26
+
+
+def log_trace(record):
+    """ Trace sink that writes a step() trace record to the logging module. """
+    logging.info("Keyboard Input: {}".format(record["input"]))
+    logging.info("Rotors Position: {}. Ringstellung: {}".format(record["positions"], record["ringstellung"]))
+    logging.info("Plugboard Encryption: {}".format(record["plugboard_in"]))
+    logging.info("Wheel 3 Encryption: {}".format(record["wheel_3"]))
+    logging.info("Wheel 2 Encryption: {}".format(record["wheel_2"]))
+    logging.info("Wheel 1 Encryption: {}".format(record["wheel_1"]))
+    logging.info("Reflector Encryption: {}".format(record["reflector"]))
+    logging.info("Wheel 1 Encryption: {}".format(record["wheel_1_back"]))
+    logging.info("Wheel 2 Encryption: {}".format(record["wheel_2_back"]))
+    logging.info("Wheel 3 Encryption: {}".format(record["wheel_3_back"]))
+    logging.info("Plugboard Encryption: {}".format(record["plugboard_out"]))
+    logging.info("Output (Lampboard): {}".format(record["output"]))
+    logging.info("--------------------------------------------------------------------")
+
+
+# Memory of one lazily built table: a 26 byte bytes object
+TABLE_BYTES = 59
+
+
+class CompiledTables():
+    """ Full substitution (plugboard, rotors, reflector and back) for every rotor
+    position of one machine configuration. Positions are numbered
+    left * 676 + middle * 26 + right using the rotation offsets. Tables are
+    built lazily, the first time a position is reached. """
+
+    def __init__(self, rotors, reflector, plugboard):
+        # rotors is (socket 1, socket 2, socket 3). Only wiring and ring are used,
+        # so the tables stay valid while the rotors turn.
+        self.wheels = tuple((r.forward, r.inverse, r.ring) for r in rotors)
+        self.reflector = reflector.contact_nums
+        self.plugboard = tuple(plugboard)
+        self.tables = [None] * 17576
+        self.built = 0
+        self.full = None
+
+        # TablesCache holding these tables, told when they grow. Set by the cache.
+        self.cache = None
+
+    def table(self, index):
+        t = self.tables[index]
+        if t is None:
+            if self.full is not None:
+                t = self.full[index].tobytes()
+            else:
+                t = self.build(index)
+            self.tables[index] = t
+            self.built += 1
+            if self.cache is not None:
+                self.cache.grew(TABLE_BYTES)
+        return t
+
+    def nbytes(self):
+        """ Rough memory use: the table list, each built bytes table and the numpy array. """
+        size = 8 * len(self.tables) + TABLE_BYTES * self.built
+        if self.full is not None:
+            size += self.full.nbytes
+        return size
+
+    def array(self):
+        """ All 17576 tables as one numpy uint8 array of shape (17576, 26). """
+        if self.full is None:
+            (f1, i1, ring1), (f2, i2, ring2), (f3, i3, ring3) = [
+                (np.array(f), np.array(i), ring) for f, i, ring in self.wheels]
+            index = np.arange(17576)[:, None]
+            s1 = (index // 676 - ring1) % 26
+            s2 = (index // 26 % 26 - ring2) % 26
+            s3 = (index % 26 - ring3) % 26
+            ref = np.array(self.reflector)
+            pb = np.array(self.plugboard)
+
+            c = pb[np.arange(26)][None, :]
+            c = (f3[(c + s3) % 26] - s3) % 26
+            c = (f2[(c + s2) % 26] - s2) % 26
+            c = (f1[(c + s1) % 26] - s1) % 26
+            c = ref[c]
+            c = (i1[(c + s1) % 26] - s1) % 26
+            c = (i2[(c + s2) % 26] - s2) % 26
+            c = (i3[(c + s3) % 26] - s3) % 26
+            self.full = pb[c].astype(np.uint8)
+            if self.cache is not None:
+                self.cache.grew(self.full.nbytes)
+
+        return self.full
+
+    def build(self, index):
+        """ Returns the 26 letter substitution at position index as bytes of 0-25. """
+        (f1, i1, ring1), (f2, i2, ring2), (f3, i3, ring3) = self.wheels
+        s1 = (index // 676 - ring1) % 26
+        s2 = (index // 26 % 26 - ring2) % 26
+        s3 = (index % 26 - ring3) % 26
+        ref = self.reflector
+        pb = self.plugboard
+
+        out = []
+        for x in range(26):
+            c = pb[x]
+            c = (f3[(c + s3) % 26] - s3) % 26
+            c = (f2[(c + s2) % 26] - s2) % 26
+            c = (f1[(c + s1) % 26] - s1) % 26
+            c = ref[c]
+            c = (i1[(c + s1) % 26] - s1) % 26
+            c = (i2[(c + s2) % 26] - s2) % 26
+            c = (i3[(c + s3) % 26] - s3) % 26
+            out.append(pb[c])
+
+        return bytes(out)
+
+
+# Compiled tables shared by all machines in this process, keyed by fingerprint.
+tables_cache = TablesCache()
+
+
+def encrypt_segment(job):
+    """ Process pool worker for EnigmaMachine.encrypt_parallel. """
+    snap, start, msg = job
+    machine = EnigmaMachine()
+    machine.restore(snap)
+    machine.seek(start)
+    return machine.encrypt_msg(msg)
+
+
+class MachineConfig(namedtuple("MachineConfig", ["rotors", "ringstellung", "offsets", "reflector", "plugboard"])):
+    """ A complete key. rotors are the rotor numbers for sockets 1, 2, 3.
+    ringstellung and offsets are three letter strings like "AKF". plugboard is a
+    sequence of letter pairs like (("U", "A"), ("V", "D")). The key is checked
+    when it is created, so EnigmaMachine.apply() does not check it again. """
+    __slots__ = ()
+
+    def __new__(cls, rotors=(1, 2, 3), ringstellung="AAA", offsets="AAA", reflector="UKW-B", plugboard=()):
+        rotors = tuple(rotors)
+        if len(rotors) != 3:
+            raise ValueError("rotors must have 3 rotor numbers")
+        for item in rotors:
+            if not isinstance(item, int) or item not in [1,2,3,4,5]:
+                raise ValueError("rotors must contain 3 of the following numbers 1,2,3,4,5")
+        if len(set(rotors)) != 3:
+            raise ValueError("rotors cannot have any duplicates")
+
+        for name, val in (("ringstellung", ringstellung), ("offsets", offsets)):
+            if not isinstance(val, str) or len(val) != 3 or any(x not in LETTER_NUMS for x in val):
+                raise ValueError("{} must be 3 uppercase letters. e.g. 'AKF'".format(name))
+
+        if reflector not in ["UKW-B", "UKW-C"]:
+            raise ValueError("reflector must be either 'UKW-B' or 'UKW-C'")
+
+        plugboard = tuple(tuple(pair) for pair in plugboard)
+        if len(plugboard) > 10:
+            raise ValueError("plugboard can have at most ten pairs")
+        plugged = set()
+        for pair in plugboard:
+            if len(pair) != 2 or any(x not in LETTER_NUMS for x in pair):
+                raise ValueError("plugboard pairs must be two uppercase letters")
+            if pair[0] in plugged or pair[1] in plugged or pair[0] == pair[1]:
+                raise ValueError("each letter can only be used once on the plugboard")
+            plugged.update(pair)
+
+        return super().__new__(cls, rotors, ringstellung, offsets, reflector, plugboard)
+
+    @classmethod
+    def _make(cls, iterable):
+        # namedtuple's _make and _replace skip __new__. Go through it so the result is checked too.
+        return cls(*iterable)
+
+    def _replace(self, **kwargs):
+        return type(self)(**dict(self._asdict(), **kwargs))
+
+    @classmethod
+    def from_machine(cls, machine):
+        rotors = (machine.sockets[1], machine.sockets[2], machine.sockets[3])
+        return cls(tuple(machine.rotor_order),
+                   "".join(r.ringstellung for r in rotors),
+                   "".join(r.rotation_offset for r in rotors),
+                   machine.reflector.type,
+                   tuple(machine.plugboard))
+
+    def tables_key(self):
+        """ The part of the key that compiled tables depend on. Offsets are left
+        out, so keys that differ only in start position share tables. """
+        plugboard = tuple(sorted(tuple(sorted(pair)) for pair in self.plugboard))
+        return (tuple(self.rotors), self.ringstellung, self.reflector, plugboard)
+
+
+def encrypt_group(jobs):
+    """ Encrypts (config, text) jobs that share one tables_key() on a single
+    compiled machine, only moving the rotors between messages. """
+    machine = EnigmaMachine()
+    machine.set_compiled(True)
+
+    out = []
+    for config, text in jobs:
+        machine.apply(config)
+        out.append(machine.encrypt_msg(text))
+    return out
+
+
+def encrypt_batch(jobs, processes=1, pool=None):
+    """ Encrypts a list of (MachineConfig, text) pairs, each message from its
+    own key. Messages are grouped by the tables they need, so each set of
+    tables is built once. Groups run on a process pool when processes > 1 or
+    a pool is given. Results come back in input order. Decrypting is the same
+    call with the ciphertexts. """
+    groups = {}
+    for i, (config, text) in enumerate(jobs):
+        groups.setdefault(config.tables_key(), []).append(i)
+    order = list(groups.values())
+    work = [[jobs[i] for i in indexes] for indexes in order]
+
+    if pool is not None:
+        parts = pool.map(encrypt_group, work)
+    elif processes > 1 and len(work) > 1:
+        with multiprocessing.Pool(processes) as new_pool:
+            parts = new_pool.map(encrypt_group, work)
+    else:
+        parts = [encrypt_group(group) for group in work]
+
+    results = [None] * len(jobs)
+    for indexes, texts in zip(order, parts):
+        for i, text in zip(indexes, texts):
+            results[i] = text
+    return results
+
 
 class EnigmaMachine():
+    # Per machine state only. Wiring, reflectors and the alphabet are shared.
+    __slots__ = ("r_table", "plugboard", "plugboard_map", "sockets", "rotor_order", "reflector",
+                 "compiled", "tables", "path", "cache", "trace", "profiler", "vector_threshold", "vector_block")
+
+    # Reflectors do not move, so all machines use the same ones
+    reflectors_available = REFLECTORS
+
+    a = LETTERS
+
     def __init__(self):
-        # Create all rotors used in a M3 Enigma machine
-        self.r1 = Rotor("I", [letter for letter in "EKMFLGDQVZNTOWYHXUSPAIBRCJ"], ["Q"])
-        self.r2 = Rotor("II", [letter for letter in "AJDKSIRUXBLHWTMCQGZNPYFVOE"], ["E"])
-        self.r3 = Rotor("III", [letter for letter in "BDFHJLCPRTXVZNYEIWGAKMUSQO"], ["V"])
-        self.r4 = Rotor("IV", [letter for letter in "ESOVPZJAYQUIRHXLNFTGKDCMWB"], ["J"])
-        self.r5 = Rotor("V", [letter for letter in "VZBRGITYUPSDNHLXAWMJQOFECK"], ["Z"])
+        # Create all rotors used in a M3 Enigma machine. The wiring is shared
+        # with every other machine, each Rotor only holds ring and offset.
         # Store rotors in number mapped dictionary
-        self.r_table = {
-            1: self.r1,
-            2: self.r2,
-            3: self.r3,
-            4: self.r4,
-            5: self.r5
-        }
+        self.r_table = {n: Rotor(wiring) for n, wiring in WIRINGS.items()}
         
-        # plugboard
+        # plugboard. Pair list for display, plus the same wiring as a
+        # self-inverse permutation of letter numbers for substitution. The map
+        # is a tuple and replaced, never changed, so snapshots can share it.
         self.plugboard = []
+        self.plugboard_map = NO_PAIRS
 
         # Initialize rotor sockets
         self.sockets = {
-            1: self.r1,
-            2: self.r2,
-            3: self.r3
-        }
-
-        # Create reflectors
-        self.reflectors_available = {
-            "UKW-B": Reflector("UKW-B", [letter for letter in "YRUHQSLDPXNGOKMIEBFZCWVJAT"]),
-            "UKW-C": Reflector("UKW-C", [letter for letter in "FVPJIAOYEDRZXWGCTKUQSBNMHL"])
+            1: self.r_table[1],
+            2: self.r_table[2],
+            3: self.r_table[3]
         }
+        self.rotor_order = (1, 2, 3)
 
         self.reflector = self.reflectors_available["UKW-B"]
 
-        self.a = [letter for letter in "ABCDEFGHIJKLMNOPQRSTUVWXYZ"]
-
+        # Compiled mode: one table lookup per keypress. See set_compiled()
+        self.compiled = False
+        self.tables = None
+
+        # Stages of step() for the current rotors and reflector. See signal_path()
+        self.path = None
+
+        # LRU cache that compile() looks tables up in. None to always rebuild.
+        self.cache = tables_cache
+
+        # Trace sink. None means step() does no tracing work at all. See set_trace()
+        self.trace = None
+
+        # Stage counters and timers. None when off. See enable_profiling()
+        self.profiler = None
+
+        # encrypt_msg switches to the numpy path for messages at least this long
+        self.vector_threshold = 2048
+        self.vector_block = 1 << 20
+
+
+    def set_compiled(self, flag=True):
+        """ Turns compiled mode on or off. In compiled mode step() looks the
+        whole substitution up in a table for the current rotor position. """
+        self.compiled = flag
+
+    def enable_profiling(self, profiler=None):
+        """ Starts counting and timing each stage of step(), table hits and
+        misses and double steps. Returns the StageProfiler in use. """
+        if profiler is None:
+            profiler = StageProfiler()
+        profiler.cache = self.cache
+        self.profiler = profiler
+        return profiler
+
+    def disable_profiling(self):
+        self.profiler = None
+
+    def set_trace(self, sink):
+        """ Sets the trace sink. sink is called with a dict of every stage
+        (plugboard, each wheel, reflector, lampboard) for each keypress.
+        Pass log_trace to write the classic log lines, or None to turn tracing off.
+        While tracing, step() takes the stage by stage path even in compiled mode. """
+        if sink is not None and not callable(sink):
+            raise TypeError("sink must be callable or None")
+        self.trace = sink
+
+    def invalidate_tables(self):
+        """ Drops compiled tables. Called whenever the wiring path changes. """
+        self.tables = None
+        self.path = None
+
+    def compile(self):
+        """ Returns the compiled tables for the current configuration. """
+        if self.tables is None:
+            rotors = (self.sockets[1], self.sockets[2], self.sockets[3])
+            build = lambda: CompiledTables(rotors, self.reflector, self.plugboard_map)
+            if self.cache is None:
+                self.tables = build()
+            else:
+                self.tables = self.cache.get(self.fingerprint(), build)
+
+        return self.tables
+
+    def fingerprint(self):
+        """ Immutable key for everything the compiled tables depend on: rotor
+        order, ring settings, reflector and plugboard. Rotor positions are not
+        part of it. Equal to MachineConfig.from_machine(self).tables_key(). """
+        rotors = (self.sockets[1], self.sockets[2], self.sockets[3])
+        plugboard = tuple((ALPHABET[i], ALPHABET[j]) for i, j in enumerate(self.plugboard_map) if i < j)
+        return (tuple(self.rotor_order), "".join(r.ringstellung for r in rotors), self.reflector.type, plugboard)
+
+    def position_index(self):
+        """ Current rotor position as a table index. """
+        return self.sockets[1].offset * 676 + self.sockets[2].offset * 26 + self.sockets[3].offset
+
+    def advance(self, n):
+        """ Presses n keys without encrypting. Returns a numpy array with the
+        position index after each press. """
+        left_rot, mid_rot, right_rot = self.sockets[1], self.sockets[2], self.sockets[3]
+        l, m, r = odometer(left_rot.offset, mid_rot.offset, right_rot.offset,
+                           mid_rot.notch_nums[0], right_rot.notch_nums[0], np.arange(1, n + 1))
+        if n:
+            left_rot.offset, mid_rot.offset, right_rot.offset = int(l[-1]), int(m[-1]), int(r[-1])
+        return l * 676 + m * 26 + r
+
+    def period(self):
+        """ Keypresses after which the rotor positions repeat. Rotors I to V have
+        one notch each, so the middle rotor turns 25 times per revolution of the
+        right rotor group (the double step skips one) and the cycle is
+        26 * 25 * 26. A start position off the cycle joins it within two
+        keypresses. """
+        return 26 * 25 * 26
+
+    def seek(self, n):
+        """ Moves the rotors to where they would be after n keypresses,
+        double-stepping included, without stepping through them. """
+        if not isinstance(n, int):
+            raise TypeError("n must be an integer")
+        if n < 0:
+            raise ValueError("n cannot be negative")
+
+        left_rot, mid_rot, right_rot = self.sockets[1], self.sockets[2], self.sockets[3]
+        l, m, r = odometer(left_rot.offset, mid_rot.offset, right_rot.offset,
+                           mid_rot.notch_nums[0], right_rot.notch_nums[0], n)
+        left_rot.offset, mid_rot.offset, right_rot.offset = l, m, r
+
+    def encrypt_codes(self, codes):
+        """ Encrypts a numpy array of letter numbers (0-25) in one shot and
+        returns the cipher as a uint8 array of letter numbers. """
+        if self.profiler is not None:
+            start = time.perf_counter_ns()
+
+        full = self.compile().array()
+        out = np.empty(len(codes), dtype=np.uint8)
+        block = self.vector_block
+        for i in range(0, len(codes), block):
+            chunk = codes[i:i + block]
+            before = self.position_index()
+            index = self.advance(len(chunk))
+            out[i:i + block] = full[index, chunk]
+
+            if self.profiler is not None and len(chunk):
+                # A double step is a press that starts with the middle rotor on its notch
+                mids = np.concatenate(([before], index[:-1])) // 26 % 26
+                self.profiler.double_steps += int((mids == self.sockets[2].notch_nums[0]).sum())
+
+        if self.profiler is not None:
+            self.profiler.add("bulk", time.perf_counter_ns() - start, len(codes))
+            self.profiler.tick(len(codes))
+        return out
 
     def set_reflector(self, name):
         if name not in self.reflectors_available.keys():
             raise ValueError("name must be either 'UKW-B' or 'UKW-C'")
         self.reflector = self.reflectors_available[name]
+        self.invalidate_tables()
 
     def set_sockets(self, l):
         """ Sets sockets. l is list of rotors in ascending socket order. Ex:
@@ -73,6 +476,7 @@ class EnigmaMachine():
         for i in range(len(l)):
             val = l[i]
             self.sockets[i+1] = self.r_table[val] 
+        self.rotor_order = tuple(l)
         
         
         # Need to reset rotors to position A
@@ -82,6 +486,8 @@ class EnigmaMachine():
     def reset_rotor_settings(self, pos=None):
         """ Resets rotor settings to ringstellung A, offset A. """
         
+        self.invalidate_tables()
+
         # pos has to be int
         if pos is not None: 
             self.sockets[pos].reset()
@@ -105,6 +511,7 @@ class EnigmaMachine():
             raise ValueError("sock must be 1, 2, or 3")
 
         self.sockets[sock_index].set_ringstellung(ringstellung)
+        self.invalidate_tables()
 
 
     def set_rotor_initial_offset(self, sock_index, offset):
@@ -114,6 +521,8 @@ class EnigmaMachine():
         if sock_index not in [1, 2, 3]:
             raise ValueError("sock must be 1, 2, or 3")
         
+        # Tables are indexed by absolute rotor position, so moving
+        # the rotors does not invalidate them.
         self.sockets[sock_index].set_initial_offset(offset)
         
 
@@ -126,7 +535,7 @@ class EnigmaMachine():
         right_rot = self.sockets[3]
 
         # If on middle rotor's notch. rotate all three rotors
-        on_mid_rot_notch = mid_rot.rotation_offset in mid_rot.notches
+        on_mid_rot_notch = mid_rot.offset in mid_rot.wiring.notch_nums
         if on_mid_rot_notch:
             
             left_rot.rotate() # rotate left rotor
@@ -136,7 +545,7 @@ class EnigmaMachine():
             return
 
         # If on right rotor's notch. rotate middle and right rotor
-        on_right_rot_notch = right_rot.rotation_offset in right_rot.notches
+        on_right_rot_notch = right_rot.offset in right_rot.wiring.notch_nums
         if on_right_rot_notch:
             
             mid_rot.rotate() 
@@ -149,22 +558,13 @@ class EnigmaMachine():
         
             
     def switch_signal(self, letter):        
-        if letter not in self.a:
+        try:
+            i = LETTER_NUMS[letter]
+        except (KeyError, TypeError):
             raise ValueError("letter must be uppercase alphabetical character.")        
-        pb = self.plugboard
 
-        # Check if let has a plugboard pair
-        for pair in pb:
-            if letter in pair:                
-                # return letter it is paired with 
-                for x in pair:
-                    if x != letter:
-                        logging.debug("plugboard pair found {}, x is {}".format(pair, x))
-                        return x
-
-        # If pair not found, return original letter
-        logging.debug("no plugboard pair found")
-        return letter
+        # Unplugged letters map to themselves
+        return ALPHABET[self.plugboard_map[i]]
         
     def encrypt_msg(self, msg):
         """ Encrypts a message / string. """
@@ -173,62 +573,352 @@ class EnigmaMachine():
         
         # Get rid of whitespaces
         msg = msg.replace(" ", "")
+
+        if np is not None and self.trace is None and len(msg) >= self.vector_threshold:
+            return self.encrypt_msg_vectorized(msg)
         
         cipher_text = []
         for letter in msg:
             c = self.step(letter)
             cipher_text.append(c)
 
-        return cipher_text
+        return "".join(cipher_text)
+
+    def encrypt_msg_vectorized(self, msg):
+        """ Same result as encrypt_msg, computed with numpy over the whole message. """
+        if not msg.isascii():
+            raise ValueError("letter must be uppercase alphabetical character.")
+        codes = np.frombuffer(msg.encode("ascii"), dtype=np.uint8) - 65
+        if len(codes) and codes.max() > 25:
+            raise ValueError("letter must be uppercase alphabetical character.")
+
+        return (self.encrypt_codes(codes) + 65).tobytes().decode("ascii")
+
+    def encrypt_parallel(self, msg, processes=None, pool=None):
+        """ Encrypts a long message on several processes. Each worker starts
+        from the rotor state for its segment (found with seek) and the parts are
+        joined in order, so the result equals encrypt_msg(msg). pool may be an
+        existing multiprocessing pool to reuse between calls. """
+        if not isinstance(msg, str):
+            raise TypeError("msg must be a string")
+        msg = msg.replace(" ", "")
+
+        if processes is None:
+            processes = os.cpu_count() or 1
+        if processes < 1:
+            raise ValueError("processes must be at least 1")
+
+        # Not worth the process overhead, or a trace sink cannot follow the workers.
+        if processes == 1 or len(msg) < 2 * self.vector_threshold or self.trace is not None:
+            return self.encrypt_msg(msg)
+
+        size = -(-len(msg) // processes)
+        snap = self.snapshot()
+        jobs = [(snap, start, msg[start:start + size]) for start in range(0, len(msg), size)]
+
+        if pool is not None:
+            parts = pool.map(encrypt_segment, jobs)
+        else:
+            with multiprocessing.Pool(processes) as new_pool:
+                parts = new_pool.map(encrypt_segment, jobs)
+
+        self.seek(len(msg))
+        return "".join(parts)
+
+    def snapshot(self):
+        """ Whole machine state as a flat tuple of small ints: rotor numbers
+        for sockets 1, 2, 3, their ring settings, the reflector's index in
+        REFLECTOR_TYPES, the three rotor offsets, and the plugboard map.
+        Cheap enough to take before every branch of a search. """
+        left, mid, right = self.sockets[1], self.sockets[2], self.sockets[3]
+        order = self.rotor_order
+        return (order[0], order[1], order[2], left.ring, mid.ring, right.ring,
+                REFLECTOR_TYPES.index(self.reflector.type),
+                left.offset, mid.offset, right.offset, self.plugboard_map)
+
+    def restore(self, snap):
+        """ Puts the machine back in a state returned by snapshot(). When only
+        the rotor offsets differ this is three assignments, and compiled tables
+        are kept. snap is trusted to come from snapshot().
+
+        The snapshot keeps the plugboard as a map, not as the pair list. If the
+        map changes, the pair list is rebuilt from it in normalized form:
+        pairs in alphabetical order, lower letter first, so 'U A' comes back
+        as ('A', 'U'). If the map is the same, the pair list is left as it was. """
+        o1, o2, o3, g1, g2, g3, ref, p1, p2, p3, pb = snap
+        sockets = self.sockets
+        left, mid, right = self.r_table[o1], self.r_table[o2], self.r_table[o3]
+        reflector = self.reflectors_available[REFLECTOR_TYPES[ref]]
+
+        if (sockets[1] is not left or sockets[2] is not mid or sockets[3] is not right
+                or left.ring != g1 or mid.ring != g2 or right.ring != g3
+                or reflector is not self.reflector or pb != self.plugboard_map):
+            sockets[1], sockets[2], sockets[3] = left, mid, right
+            left.ring, mid.ring, right.ring = g1, g2, g3
+            self.rotor_order = (o1, o2, o3)
+            self.reflector = reflector
+            if pb != self.plugboard_map:
+                self.plugboard_map = tuple(pb)
+                self.plugboard = [(ALPHABET[i], ALPHABET[j]) for i, j in enumerate(pb) if i < j]
+            self.invalidate_tables()
+
+        left.offset, mid.offset, right.offset = p1, p2, p3
+
+    def apply(self, config):
+        """ Sets rotor order, ring settings, offsets, reflector and plugboard
+        from a MachineConfig in one go. Unlike set_sockets this does not reset
+        and re-walk the rotors, and compiled tables are only dropped when the
+        wiring actually changes. """
+        if not isinstance(config, MachineConfig):
+            raise TypeError("config must be a MachineConfig")
+
+        rotors = [self.r_table[n] for n in config.rotors]
+        rings = [LETTER_NUMS[x] for x in config.ringstellung]
+        reflector = self.reflectors_available[config.reflector]
+        pb = list(NO_PAIRS)
+        for let_1, let_2 in config.plugboard:
+            pb[LETTER_NUMS[let_1]] = LETTER_NUMS[let_2]
+            pb[LETTER_NUMS[let_2]] = LETTER_NUMS[let_1]
+        pb = tuple(pb)
+
+        changed = (config.rotors != self.rotor_order or reflector is not self.reflector
+                   or pb != self.plugboard_map
+                   or any(self.sockets[i + 1].ring != rings[i] for i in range(3)))
+
+        for i in range(3):
+            rotors[i].ring = rings[i]
+            rotors[i].offset = LETTER_NUMS[config.offsets[i]]
+            self.sockets[i + 1] = rotors[i]
+        self.rotor_order = config.rotors
+        self.reflector = reflector
+        self.plugboard = list(config.plugboard)
+        self.plugboard_map = pb
+
+        if changed:
+            self.invalidate_tables()
+
+    def encrypt_chunk(self, data):
+        """ Encrypts a chunk of bytes. Letters of either case are encrypted and
+        come out uppercase. Any other byte is copied through unchanged and does
+        not move the rotors, so a text can be fed in pieces of any size. """
+        return self.encrypt_bytes(data)
+
+    def encrypt_bytes(self, data, into=None):
+        """ Encrypts a bytes, bytearray or memoryview the same way as
+        encrypt_chunk, without going through str. If into is given (a writable
+        buffer at least as long as data, possibly data itself) the result is
+        written there and into is returned. Otherwise returns new bytes.
+        Both buffers must be contiguous. """
+        try:
+            src = memoryview(data)
+        except TypeError:
+            raise TypeError("data must be bytes, bytearray or memoryview")
+        if not src.c_contiguous:
+            raise TypeError("data must be a contiguous buffer")
+        if src.format != "B":
+            src = src.cast("B")
+        n = len(src)
+
+        if into is not None:
+            dst = memoryview(into)
+            if not dst.c_contiguous:
+                raise TypeError("into must be a contiguous buffer")
+            if dst.format != "B":
+                dst = dst.cast("B")
+            if dst.readonly:
+                raise TypeError("into must be a writable buffer")
+            if len(dst) < n:
+                raise ValueError("into must be at least as long as data")
+
+        # numpy needs the full table. Building it costs more than a few
+        # thousand lazy lookups, so it is only worth it for long buffers or
+        # when the table is already there.
+        if (np is not None and self.trace is None and n >= SMALL_BUFFER
+                and (n >= self.vector_threshold or self.compile().full is not None)):
+            buf = np.frombuffer(src, dtype=np.uint8)
+            out = np.empty(n, dtype=np.uint8) if into is None else np.frombuffer(dst, dtype=np.uint8, count=n)
+            upper = buf & 0xDF
+            letters = (upper >= 65) & (upper <= 90)
+            codes = upper[letters] - 65
+            out[:] = buf
+            out[letters] = self.encrypt_codes(codes) + 65
+            return out.tobytes() if into is None else into
+
+        out = bytearray(n) if into is None else dst
+        if self.trace is not None or self.profiler is not None:
+            # step() does the tracing and profiling
+            for i in range(n):
+                c = src[i]
+                if 97 <= c <= 122:
+                    c -= 32
+                out[i] = ord(self.step(chr(c))) if 65 <= c <= 90 else c
+        else:
+            tables = self.compile()
+            for i in range(n):
+                c = src[i]
+                if 97 <= c <= 122:
+                    c -= 32
+                if 65 <= c <= 90:
+                    self.rotate_rotors()
+                    c = tables.table(self.position_index())[c - 65] + 65
+                out[i] = c
+        return bytes(out) if into is None else into
+
+    def decrypt_bytes(self, data, into=None):
+        """ Same as encrypt_bytes. The machine is its own inverse, so this
+        decrypts when the rotors are back at the start position. """
+        return self.encrypt_bytes(data, into)
+
+    def encrypt_stream(self, src, dst, chunk_size=1 << 16):
+        """ Encrypts binary file object src into dst chunk_size bytes at a time.
+        Memory use does not depend on the input size. Returns the number of
+        bytes written. """
+        total = 0
+        while True:
+            chunk = src.read(chunk_size)
+            if not chunk:
+                break
+            dst.write(self.encrypt_chunk(chunk))
+            total += len(chunk)
+        dst.flush()
+        return total
+
+    def encrypt_file(self, src, dst=None, window=1 << 24):
+        """ Encrypts the file at path src into the file at path dst, or in
+        place when dst is None or the same file. Both are memory mapped and
+        handled window bytes at a time, so files larger than RAM work. Bytes
+        are treated as in encrypt_chunk. Returns the number of bytes. """
+        if window < 1:
+            raise ValueError("window must be positive")
+        in_place = dst is None or (os.path.exists(dst) and os.path.samefile(src, dst))
+        size = os.path.getsize(src)
+
+        with open(src, "r+b" if in_place else "rb") as f_in:
+            if in_place:
+                f_out = f_in
+            else:
+                f_out = open(dst, "w+b")
+            try:
+                if size == 0:
+                    return 0
+                f_out.truncate(size)
+                m_in = mmap.mmap(f_in.fileno(), 0, access=mmap.ACCESS_WRITE if in_place else mmap.ACCESS_READ)
+                m_out = m_in if in_place else mmap.mmap(f_out.fileno(), 0, access=mmap.ACCESS_WRITE)
+                try:
+                    for i in range(0, size, window):
+                        self.encrypt_window(m_in, m_out, i, min(i + window, size))
+                    m_out.flush()
+                finally:
+                    if not in_place:
+                        m_out.close()
+                    m_in.close()
+            finally:
+                if not in_place:
+                    f_out.close()
+        return size
+
+    def encrypt_window(self, m_in, m_out, start, end):
+        """ Encrypts bytes start:end of buffer m_in into the same bytes of m_out. """
+        with memoryview(m_in) as view_in, memoryview(m_out) as view_out:
+            src = view_in[start:end]
+            dst = view_out[start:end]
+            self.encrypt_bytes(src, into=dst)
+            src.release()
+            dst.release()
 
     def step(self, letter):
         """ Encrypts / Decrypts one letter. The meat of the enigma machine."""
         if letter not in self.a:
             raise ValueError("letter must be uppercase alphabetical character.")
-        
 
-        # switch signal using plugboard
-        new_let = self.switch_signal(letter)
-        
+        if self.profiler is not None:
+            return self.profiled_step(letter)
+
         # Attempt to rotate all rotors.
         self.rotate_rotors()
 
-        # encrypt signal (input) through rotors. Signal hits third rotor first.
-        out_1 = self.sockets[3].encrypt(new_let)
-        out_2 = self.sockets[2].encrypt(out_1)
-        out_3 = self.sockets[1].encrypt(out_2)
-
-        # reflect signal using reflector
-        out_4 = self.reflector.encrypt(out_3)
+        if self.compiled and self.trace is None:
+            # Look up the whole path at once.
+            return ALPHABET[self.compile().table(self.position_index())[ord(letter) - 65]]
 
-        # reflect encrypt rotors
-        out_5 = self.sockets[1].backwards_encrypt(out_4)
-        out_6 = self.sockets[2].backwards_encrypt(out_5)
-        out_7 = self.sockets[3].backwards_encrypt(out_6)
+        if self.trace is not None:
+            signal = [letter]
+            for stage, encrypt in self.signal_path():
+                signal.append(encrypt(signal[-1]))
+            self.trace(self.trace_record(signal))
+            return signal[-1]
 
-        # switch signal on switchboard for final output.
-        fin = self.switch_signal(out_7)
-
-        # Info logs 
-        logging.info("Keyboard Input: {}".format(letter))
-        logging.info("Rotors Position: {}{}{}. Ringstellung: {}{}{}".format(self.sockets[1].rotation_offset, self.sockets[2].rotation_offset, self.sockets[3].rotation_offset, self.sockets[1].ringstellung, self.sockets[2].ringstellung, self.sockets[3].ringstellung ))
-        logging.info("Plugboard Encryption: {}".format(new_let))
-        logging.info("Wheel 3 Encryption: {}".format(out_1))
-        logging.info("Wheel 2 Encryption: {}".format(out_2))
-        logging.info("Wheel 1 Encryption: {}".format(out_3))
-        logging.info("Reflector Encryption: {}".format(out_4))
-        logging.info("Wheel 1 Encryption: {}".format(out_5))
-        logging.info("Wheel 2 Encryption: {}".format(out_6))
-        logging.info("Wheel 3 Encryption: {}".format(out_7))
-        logging.info("Plugboard Encryption: {}".format(fin))
-        logging.info("Output (Lampboard): {}".format(fin))
-        logging.info("--------------------------------------------------------------------")
+        for stage, encrypt in self.signal_path():
+            letter = encrypt(letter)
+        return letter
 
-        return fin
+    def signal_path(self):
+        """ (stage name, function) pairs a letter passes through after the
+        rotors have turned, in signal order. The names are the stages of the
+        trace record and of the profiler. Kept until invalidate_tables(). """
+        if self.path is not None:
+            return self.path
+        left, mid, right = self.sockets[1], self.sockets[2], self.sockets[3]
+        self.path = (("plugboard_in", self.switch_signal),
+                # Signal hits third rotor first
+                ("wheel_3", right.encrypt),
+                ("wheel_2", mid.encrypt),
+                ("wheel_1", left.encrypt),
+                ("reflector", self.reflector.encrypt),
+                ("wheel_1_back", left.backwards_encrypt),
+                ("wheel_2_back", mid.backwards_encrypt),
+                ("wheel_3_back", right.backwards_encrypt),
+                ("plugboard_out", self.switch_signal))
+        return self.path
+
+    def trace_record(self, signal):
+        """ Trace record of one keypress. signal is the input letter followed by
+        the output of every stage of signal_path(). """
+        record = {
+            "input": signal[0],
+            "positions": self.sockets[1].rotation_offset + self.sockets[2].rotation_offset + self.sockets[3].rotation_offset,
+            "ringstellung": self.sockets[1].ringstellung + self.sockets[2].ringstellung + self.sockets[3].ringstellung
+        }
+        for (stage, encrypt), out in zip(self.signal_path(), signal[1:]):
+            record[stage] = out
+        record["output"] = signal[-1]
+        return record
 
+    def profiled_step(self, letter):
+        """ step() with every stage counted and timed by self.profiler. """
+        prof = self.profiler
+        clock = time.perf_counter_ns
 
+        if self.sockets[2].offset in self.sockets[2].notch_nums:
+            prof.double_steps += 1
 
-    
+        start = clock()
+        self.rotate_rotors()
+        prof.add("rotate_rotors", clock() - start)
+
+        if self.compiled and self.trace is None:
+            start = clock()
+            tables = self.compile()
+            index = self.position_index()
+            if tables.tables[index] is None:
+                prof.table_misses += 1
+            else:
+                prof.table_hits += 1
+            fin = ALPHABET[tables.table(index)[ord(letter) - 65]]
+            prof.add("table_lookup", clock() - start)
+            prof.tick()
+            return fin
+
+        signal = [letter]
+        for stage, encrypt in self.signal_path():
+            start = clock()
+            signal.append(encrypt(signal[-1]))
+            prof.add(stage, clock() - start)
+        prof.tick()
+
+        if self.trace is not None:
+            self.trace(self.trace_record(signal))
+        return signal[-1]
 
     def create_plugboard_pair(self, let_1, let_2):
         """ Connect two letters on plugboard. """
@@ -245,31 +935,22 @@ class EnigmaMachine():
 
         logging.debug("create_plugboard_pair() called")
 
-        # If no pairs plugboard yet, just create it
-        pair = (let_1, let_2)
-        if self.plugboard == []:
-            self.plugboard.append(pair)
-            logging.debug("create_plugboard_pair() finished. pb is {}".format(self.plugboard))
-            return
+        pb = list(self.plugboard_map)
+        i = LETTER_NUMS[let_1]
+        j = LETTER_NUMS[let_2]
         
         # if (A, B) and (C, D) in pb. then func(A, C) should result in only (A, C) left.
-        # if let_1 already paired in plugboard, get rid of that pair 
-        old_tup = None
-        for tup in self.plugboard:
-            if let_1 in tup:
-                index = self.plugboard.index(tup)
-                old_tup = self.plugboard[index]
-                self.plugboard.remove(old_tup)                
-
-        # if let_2 already paired in plugboard, get rid of that pair            
-        old_tup = None
-        for tup in self.plugboard:
-            if let_2 in tup:
-                index = self.plugboard.index(tup)
-                old_tup = self.plugboard[index]
-                self.plugboard.remove(old_tup)
-
-        self.plugboard.append(pair)
+        # if let_1 or let_2 already paired in plugboard, get rid of that pair 
+        if pb[i] != i or pb[j] != j:
+            self.plugboard = [tup for tup in self.plugboard if let_1 not in tup and let_2 not in tup]
+            pb[pb[i]] = pb[i]
+            pb[pb[j]] = pb[j]
+
+        pb[i] = j
+        pb[j] = i
+        self.plugboard_map = tuple(pb)
+        self.plugboard.append((let_1, let_2))
+        self.invalidate_tables()
 
         logging.debug("create_plugboard_pair() finished. pb is {}".format(self.plugboard))
 
@@ -279,6 +960,8 @@ class EnigmaMachine():
     def reset_plugboard(self):
         """ Resets plugboard. Get rid of pairs. """
         self.plugboard = []
+        self.plugboard_map = NO_PAIRS
+        self.invalidate_tables()
         logging.debug("reset_plugboard() finished. pb is {}".format(self.plugboard))
 
 
@@ -289,6 +972,7 @@ if __name__ == "__main__":
     logging.info('Started')
 
     e = EnigmaMachine()
+    e.set_trace(log_trace)
 
     """
     # Test case 1. basic
@@ -412,4 +1096,108 @@ if __name__ == "__main__":
     print(ans)
     print(out == ans)
 
-    # Victory at last!!!
\ No newline at end of file
+    # Victory at last!!!
+
+    # Compiled mode must match the step by step path.
+    # Rotors III, IV, V. Middle offset J (double step). Plugboard (U, A), (V, D)
+    print("Compiled mode test:")
+    results = []
+    for compiled in (False, True):
+        e = EnigmaMachine()
+        e.set_compiled(compiled)
+        e.set_sockets([3,4,5])
+        e.set_rotor_ringstellung(1, "K")
+        e.set_rotor_initial_offset(2, "J")
+        e.create_plugboard_pair("U", "A")
+        e.create_plugboard_pair("V", "D")
+        results.append(e.encrypt_msg("THEQUICKBROWNFOXJUMPSOVERTHELAZYDOG" * 30))
+    print(results[0] == results[1])
+
+    # seek(n) must land where n keypresses would.
+    print("Seek test:")
+    ok = True
+    for n in (0, 1, 2, 25, 26, 27, 650, 651, 16900, 20000):
+        a = EnigmaMachine()
+        b = EnigmaMachine()
+        for m in (a, b):
+            m.set_sockets([2, 1, 3])
+            m.set_rotor_initial_offset(2, "D")
+            m.set_rotor_initial_offset(3, "U")
+        for i in range(n):
+            a.rotate_rotors()
+        b.seek(n)
+        ok = ok and [r.offset for r in a.sockets.values()] == [r.offset for r in b.sockets.values()]
+    print(ok)
+
+    print("Snapshot test:")
+    a = EnigmaMachine()
+    a.set_sockets([3, 5, 1])
+    a.create_plugboard_pair("W", "Q")
+    a.create_plugboard_pair("U", "A")
+    snap = a.snapshot()
+    first = a.encrypt_msg("BRANCHONE")
+    # Same plugboard: the pair list keeps its order
+    a.set_reflector("UKW-C")
+    a.encrypt_msg("BRANCHTWO")
+    a.restore(snap)
+    ok = a.encrypt_msg("BRANCHONE") == first and a.plugboard == [("W", "Q"), ("U", "A")]
+    # Plugboard changed: the pair list comes back normalized
+    a.create_plugboard_pair("E", "R")
+    a.encrypt_msg("BRANCHTWO")
+    a.restore(snap)
+    print(ok and a.encrypt_msg("BRANCHONE") == first and a.plugboard == [("A", "U"), ("Q", "W")])
+
+    # encrypt_bytes must match step() on the numpy path and on the lazy
+    # tables, into new bytes, into a longer buffer and in place.
+    print("Bytes test:")
+    def keyed():
+        # No shared cache, so a full table from one run cannot pick the path of the next
+        m = EnigmaMachine()
+        m.cache = None
+        m.apply(MachineConfig((3, 5, 1), "AKF", "CAH", "UKW-C", (("U", "A"), ("V", "D"))))
+        return m
+
+    data = bytes(range(256)) * 12 + b"Hello, World! zz@[`{" * 40
+    ref = keyed()
+    expect = bytearray(data.upper())
+    for i, c in enumerate(expect):
+        if 65 <= c <= 90:
+            expect[i] = ord(ref.step(chr(c)))
+    ok = True
+    for threshold in (0, len(data) + 1):
+        for mode in ("new", "into", "in place"):
+            m = keyed()
+            m.vector_threshold = threshold
+            if mode == "new":
+                out = m.encrypt_bytes(data)
+            elif mode == "into":
+                buf = bytearray(len(data) + 5)
+                ok = ok and m.encrypt_bytes(data, into=buf) is buf and buf[len(data):] == bytearray(5)
+                out = buf[:len(data)]
+            else:
+                out = bytearray(data)
+                m.encrypt_bytes(out, into=out)
+            ok = ok and out == expect and m.snapshot() == ref.snapshot()
+    try:
+        keyed().encrypt_bytes(memoryview(bytearray(data))[::2])
+        ok = False
+    except TypeError:
+        pass
+    print(ok)
+
+    # encrypt_file must give the same bytes for any window size, to a new file and in place.
+    print("File test:")
+    import tempfile
+    folder = tempfile.mkdtemp()
+    src_path = os.path.join(folder, "in")
+    dst_path = os.path.join(folder, "out")
+    ok = True
+    for window in (1, 7, 4096, 1 << 24):
+        for dst in (dst_path, None):
+            with open(src_path, "wb") as f:
+                f.write(data)
+            m = keyed()
+            ok = ok and m.encrypt_file(src_path, dst, window=window) == len(data)
+            with open(dst or src_path, "rb") as f:
+                ok = ok and f.read() == expect and m.snapshot() == ref.snapshot()
+    print(ok)
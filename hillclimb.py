@@ -0,0 +1,212 @@
+""" Plugboard recovery by hill climbing, once the rotor order, ring settings
+and start position are known (for example from ioc.search).
+
+The rotors and reflector give one scrambler permutation per keypress. They do
+not depend on the plugboard, so they are computed once for the whole message.
+Decrypting under a candidate plugboard p is then p[E_t[p[c_t]]] for every
+keypress t, which numpy does for a whole batch of candidates at once.
+
+Each round tries every change involving two letters (plug them together,
+unplug them, or swap partners) and keeps the best one if it raises the n-gram
+score. The climb restarts from random plugboards until the time budget runs out.
+"""
+
+import math
+import random
+import time
+from collections import namedtuple
+
+import numpy as np
+
+from bombe import clean
+from enigma import EnigmaMachine, ALPHABET
+
+# score is the n-gram log probability of plaintext. plugboard is a list of
+# letter pairs for create_plugboard_pair.
+Result = namedtuple("Result", ["score", "plugboard", "plaintext"])
+
+
+class NgramScorer():
+    """ Sum of log10 n-gram probabilities. Unseen n-grams get a floor value. """
+
+    def __init__(self, counts):
+        # counts maps n-gram strings ("THE") to counts. All keys have the same length.
+        if not counts:
+            raise ValueError("counts cannot be empty")
+        self.n = len(next(iter(counts)))
+        total = float(sum(counts.values()))
+
+        self.table = np.full(26 ** self.n, math.log10(0.01 / total))
+        for gram, count in counts.items():
+            if len(gram) != self.n:
+                raise ValueError("all n-grams must have the same length")
+            self.table[self.index(gram)] = math.log10(count / total)
+
+    def index(self, gram):
+        i = 0
+        for letter in gram:
+            i = i * 26 + ord(letter) - 65
+        return i
+
+    @classmethod
+    def from_text(cls, text, n=3):
+        """ Counts the n-grams of a training text. Non-letters are dropped. """
+        letters = "".join(x for x in text.upper() if "A" <= x <= "Z")
+        counts = {}
+        for i in range(len(letters) - n + 1):
+            gram = letters[i:i + n]
+            counts[gram] = counts.get(gram, 0) + 1
+        return cls(counts)
+
+    @classmethod
+    def from_file(cls, path):
+        """ Reads 'NGRAM count' lines, the usual format of published n-gram tables. """
+        counts = {}
+        with open(path) as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) == 2:
+                    counts[parts[0].upper()] = int(parts[1])
+        return cls(counts)
+
+    def score_rows(self, plain):
+        """ Score of each row of a (rows, length) array of letter numbers. """
+        index = np.zeros((plain.shape[0], plain.shape[1] - self.n + 1), dtype=np.intp)
+        for i in range(self.n):
+            index = index * 26 + plain[:, i:plain.shape[1] - self.n + 1 + i]
+        return self.table[index].sum(axis=1)
+
+
+def scrambler_sequence(rotors, reflector, rings, position, length):
+    """ (length, 26) array of the scrambler permutation (plugboard left out)
+    at each keypress of a message starting at position. """
+    machine = EnigmaMachine()
+    machine.set_sockets(list(rotors))
+    machine.set_reflector(reflector)
+    for i in range(3):
+        machine.set_rotor_ringstellung(i + 1, rings[i])
+        machine.set_rotor_initial_offset(i + 1, position[i])
+    return machine.compile().array()[machine.advance(length)]
+
+
+def decrypt_rows(sequence, codes, boards):
+    """ Plaintext under each plugboard in boards, a (rows, 26) array of permutations. """
+    rows = np.arange(len(boards))[:, None]
+    inner = sequence[np.arange(len(codes))[None, :], boards[rows, codes[None, :]]]
+    return boards[rows, inner]
+
+
+def neighbours(board, max_pairs):
+    """ Plugboards that differ from board in the wiring of two letters. """
+    pairs = sum(1 for i in range(26) if board[i] != i) // 2
+    out = []
+    for i in range(26):
+        for j in range(i + 1, 26):
+            a, b = board[i], board[j]
+            new = board.copy()
+            if a == j:
+                # Unplug i and j
+                new[i], new[j] = i, j
+                out.append(new)
+                continue
+
+            # Plug i to j, unplugging their old partners
+            new[a], new[b] = a, b
+            new[i], new[j] = j, i
+            count = pairs + 1 - (a != i) - (b != j)
+            if count <= max_pairs:
+                out.append(new)
+
+            # Same, but plug the two old partners together
+            if a != i and b != j:
+                swap = new.copy()
+                swap[a], swap[b] = b, a
+                out.append(swap)
+    return out
+
+
+def random_board(rng, pairs):
+    board = np.arange(26)
+    letters = rng.sample(range(26), 2 * pairs)
+    for k in range(pairs):
+        i, j = letters[2 * k], letters[2 * k + 1]
+        board[i], board[j] = j, i
+    return board
+
+
+def climb(sequence, codes, scorer, board, max_pairs, deadline):
+    """ Steepest ascent from board. Returns (score, board). """
+    best = scorer.score_rows(decrypt_rows(sequence, codes, board[None, :]))[0]
+    while time.monotonic() < deadline:
+        candidates = np.array(neighbours(board, max_pairs))
+        scores = scorer.score_rows(decrypt_rows(sequence, codes, candidates))
+        i = int(scores.argmax())
+        if scores[i] <= best:
+            break
+        best = scores[i]
+        board = candidates[i]
+    return float(best), board
+
+
+def recover_plugboard(ciphertext, rotors, reflector, rings, position, scorer,
+                      max_pairs=10, restarts=20, budget=60.0, seed=None):
+    """ Hill climbs the plugboard for a message whose rotor settings are known.
+    Stops after restarts climbs or budget seconds, whichever comes first.
+    Returns the best Result. max_pairs is capped at 10 like create_plugboard_pair. """
+    codes = np.frombuffer(clean(ciphertext).encode("ascii"), dtype=np.uint8).astype(np.intp) - 65
+    if len(codes) < scorer.n:
+        raise ValueError("ciphertext is shorter than the n-grams")
+    max_pairs = min(max_pairs, 10)
+
+    sequence = scrambler_sequence(rotors, reflector, rings, position, len(codes)).astype(np.intp)
+    rng = random.Random(seed)
+    deadline = time.monotonic() + budget
+
+    best = None
+    for attempt in range(restarts):
+        if attempt and time.monotonic() >= deadline:
+            break
+        start = np.arange(26) if attempt == 0 else random_board(rng, rng.randint(0, max_pairs))
+        score, board = climb(sequence, codes, scorer, start, max_pairs, deadline)
+        if best is None or score > best[0]:
+            best = (score, board)
+
+    score, board = best
+    plain = decrypt_rows(sequence, codes, board[None, :])[0]
+    pairs = [(ALPHABET[i], ALPHABET[int(board[i])]) for i in range(26) if board[i] > i]
+    return Result(score, pairs, "".join(ALPHABET[x] for x in plain))
+
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) != 2:
+        print("Usage: python hillclimb.py CORPUS.txt  (English text to learn trigrams from)")
+        sys.exit(1)
+
+    with open(sys.argv[1], errors="ignore") as f:
+        scorer = NgramScorer.from_text(f.read(), 3)
+
+    plain = """
+        THE ENIGMA MACHINE IS A CIPHER DEVICE DEVELOPED AND USED IN THE EARLY TO MID
+        TWENTIETH CENTURY TO PROTECT COMMERCIAL DIPLOMATIC AND MILITARY COMMUNICATION
+        IT WAS EMPLOYED EXTENSIVELY BY NAZI GERMANY DURING WORLD WAR TWO IN ALL BRANCHES
+        OF THE GERMAN MILITARY THE MACHINE HAS SEVERAL ROTORS THAT TURN WITH EVERY KEY
+    """.replace("\n", " ")
+    pairs = [("A", "Q"), ("B", "J"), ("E", "M"), ("T", "Z"), ("R", "U"), ("C", "K")]
+
+    e = EnigmaMachine()
+    e.set_sockets([4, 2, 5])
+    e.set_rotor_ringstellung(3, "F")
+    for i, offset in enumerate("GXT"):
+        e.set_rotor_initial_offset(i + 1, offset)
+    for let_1, let_2 in pairs:
+        e.create_plugboard_pair(let_1, let_2)
+    cipher = e.encrypt_msg(plain)
+
+    start = time.time()
+    result = recover_plugboard(cipher, (4, 2, 5), "UKW-B", "AAF", "GXT", scorer, budget=30, seed=1)
+    print("Climbed in {:.1f}s".format(time.time() - start))
+    print(result.plugboard)
+    print(result.plaintext)
+    print(sorted(result.plugboard) == sorted(pairs))
@@ -0,0 +1,168 @@
+""" Ciphertext only attack using the index of coincidence (Gillogly, 1995).
+
+Decrypting with the right rotor order and start position but no plugboard
+already gives text whose letter counts look like language: the index of
+coincidence (IoC) is well above the 1/26 of random letters. So every rotor
+order and start position is tried with ring settings AAA and the plugboard
+left out, and the candidates are ranked by IoC. The ring settings of the
+right and middle rotors are then found the same way, one rotor at a time.
+
+All start positions of a rotor order are decrypted together in numpy batches
+using the compiled scrambler tables and odometer(), so no machine is stepped.
+"""
+
+import itertools
+from collections import namedtuple
+
+import numpy as np
+
+from bombe import clean, scrambler_tables
+from enigma import EnigmaMachine, ALPHABET, odometer
+
+# rotors is the rotor order for sockets 1, 2, 3. rings and position are three
+# letter strings like "AAF" and "QDK" for sockets 1, 2, 3.
+Candidate = namedtuple("Candidate", ["ioc", "rotors", "reflector", "rings", "position"])
+
+
+def to_codes(text):
+    """ Text as a numpy array of letter numbers 0-25. """
+    return np.frombuffer(clean(text).encode("ascii"), dtype=np.uint8) - 65
+
+
+def index_of_coincidence(counts, n):
+    """ IoC from letter counts along the last axis, for texts of length n. """
+    counts = counts.astype(np.int64)
+    return (counts * (counts - 1)).sum(axis=-1) / float(n * (n - 1))
+
+
+def decrypt_rows(table, codes, notches, left, mid, right, rings=(0, 0, 0)):
+    """ Decrypts codes once per row of start offsets (left, mid, right arrays)
+    and ring numbers, with no plugboard. table is the scrambler table for ring
+    settings AAA. The rotors step on their offsets, and the ring setting moves
+    the wiring back, so the table row is offset minus ring. Returns (rows, n). """
+    t = np.arange(1, len(codes) + 1)[None, :]
+    l, m, r = odometer(left[:, None], mid[:, None], right[:, None], notches[0], notches[1], t)
+    rl, rm, rr = [np.asarray(ring)[..., None] for ring in rings]
+    index = (l - rl) % 26 * 676 + (m - rm) % 26 * 26 + (r - rr) % 26
+    return table[index, codes[None, :]]
+
+
+def row_ioc(plain):
+    """ IoC of each row of a (rows, n) array of letter numbers. """
+    rows, n = plain.shape
+    flat = (np.arange(rows)[:, None] * 26 + plain).ravel()
+    counts = np.bincount(flat, minlength=rows * 26).reshape(rows, 26)
+    return index_of_coincidence(counts, n)
+
+
+def score_order(codes, order, reflector, batch=256):
+    """ IoC of the plugboard-free decryption for all 17576 start positions
+    (ring settings AAA) of one rotor order and reflector. """
+    machine, table = scrambler_tables(order, reflector)
+    notches = (machine.sockets[2].notch_nums[0], machine.sockets[3].notch_nums[0])
+
+    scores = np.empty(17576)
+    for first in range(0, 17576, batch):
+        starts = np.arange(first, min(first + batch, 17576))
+        plain = decrypt_rows(table, codes, notches, starts // 676, starts // 26 % 26, starts % 26)
+        scores[first:first + len(starts)] = row_ioc(plain)
+    return scores
+
+
+def refine_rings(codes, candidate):
+    """ Tries all 26 ring settings of the right rotor, then of the middle
+    rotor, keeping the wiring in the same place (offset moves with the ring),
+    so only the turnover points change. Returns the best Candidate. """
+    machine, table = scrambler_tables(candidate.rotors, candidate.reflector)
+    notches = (machine.sockets[2].notch_nums[0], machine.sockets[3].notch_nums[0])
+
+    offsets = np.array([ord(x) - 65 for x in candidate.position])
+    rings = np.array([ord(x) - 65 for x in candidate.rings])
+    best = candidate.ioc
+
+    for sock in (2, 1):
+        trial = np.arange(26)
+        new_rings = np.tile(rings, (26, 1))
+        new_rings[:, sock] = trial
+        new_offsets = np.tile(offsets, (26, 1))
+        new_offsets[:, sock] = (offsets[sock] - rings[sock] + trial) % 26
+
+        plain = decrypt_rows(table, codes, notches, new_offsets[:, 0], new_offsets[:, 1], new_offsets[:, 2],
+                             (new_rings[:, 0], new_rings[:, 1], new_rings[:, 2]))
+        scores = row_ioc(plain)
+        i = int(scores.argmax())
+        if scores[i] > best:
+            best = float(scores[i])
+            rings = new_rings[i]
+            offsets = new_offsets[i]
+
+    return Candidate(best, tuple(candidate.rotors), candidate.reflector,
+                     "".join(ALPHABET[x] for x in rings), "".join(ALPHABET[x] for x in offsets))
+
+
+def search(ciphertext, orders=None, reflectors=("UKW-B", "UKW-C"), top=10, refine=True):
+    """ Ranks rotor orders and start positions by the IoC of the decryption
+    with no plugboard. Tests every order in r_table (60 orders of three from
+    five) by default. Returns the top candidates, best first, with ring
+    settings refined for each when refine is set. """
+    codes = to_codes(ciphertext)
+    if len(codes) < 2:
+        raise ValueError("ciphertext is too short")
+
+    if orders is None:
+        orders = list(itertools.permutations(EnigmaMachine().r_table.keys(), 3))
+
+    best = []
+    for order in orders:
+        for reflector in reflectors:
+            scores = score_order(codes, order, reflector)
+            for start in np.argsort(scores)[::-1][:top]:
+                start = int(start)
+                position = ALPHABET[start // 676] + ALPHABET[start // 26 % 26] + ALPHABET[start % 26]
+                best.append(Candidate(float(scores[start]), tuple(order), reflector, "AAA", position))
+            best = sorted(best, reverse=True)[:top]
+
+    if refine:
+        best = sorted((refine_rings(codes, c) for c in best), reverse=True)
+    return best
+
+
+def machine_for(candidate):
+    """ EnigmaMachine set up from a candidate, at the start of the message, with an empty plugboard. """
+    machine = EnigmaMachine()
+    machine.set_sockets(list(candidate.rotors))
+    machine.set_reflector(candidate.reflector)
+    for i in range(3):
+        machine.set_rotor_ringstellung(i + 1, candidate.rings[i])
+        machine.set_rotor_initial_offset(i + 1, candidate.position[i])
+    return machine
+
+
+if __name__ == "__main__":
+    import time
+
+    plain = """
+        THE ENIGMA MACHINE IS A CIPHER DEVICE DEVELOPED AND USED IN THE EARLY TO MID
+        TWENTIETH CENTURY TO PROTECT COMMERCIAL DIPLOMATIC AND MILITARY COMMUNICATION
+        IT WAS EMPLOYED EXTENSIVELY BY NAZI GERMANY DURING WORLD WAR TWO IN ALL BRANCHES
+        OF THE GERMAN MILITARY THE MACHINE HAS SEVERAL ROTORS THAT TURN WITH EVERY KEY
+        PRESS SO THAT THE SUBSTITUTION CHANGES FROM ONE LETTER TO THE NEXT AND A
+        PLUGBOARD THAT SWAPS PAIRS OF LETTERS BEFORE AND AFTER THE ROTORS
+    """.replace("\n", " ")
+
+    e = EnigmaMachine()
+    e.set_sockets([4, 2, 5])
+    e.set_reflector("UKW-B")
+    e.set_rotor_ringstellung(3, "F")
+    for i, offset in enumerate("GXT"):
+        e.set_rotor_initial_offset(i + 1, offset)
+    for pair in ("AQ", "BJ", "EM"):
+        e.create_plugboard_pair(pair[0], pair[1])
+    cipher = e.encrypt_msg(plain)
+
+    start = time.time()
+    results = search(cipher)
+    print("Searched in {:.1f}s".format(time.time() - start))
+    for c in results[:5]:
+        print(c)
+    print(results[0].rotors == (4, 2, 5))
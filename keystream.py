@@ -0,0 +1,192 @@
+""" The whole rotor cycle of one key as a precomputed array.
+
+With single notch rotors the rotor positions repeat every 16900 keypresses
+(see EnigmaMachine.period). For a rotor order, ring settings, reflector and
+plugboard, the substitution at each position of that cycle is a row of 26
+letter numbers, so the whole keystream fits in a 16900 x 26 uint8 array
+(about 440 KB). Encrypting is then one lookup per letter: the cycle index of
+press t is the start index plus t, modulo the period.
+
+Rotor offsets are absolute, so one file serves every start position. A start
+position off the cycle (set by hand with the middle rotor on or just past its
+notch) joins it within two keypresses. Those presses are looked up in the
+compiled tables.
+
+File layout (little endian):
+
+    64 byte header   magic, period, rotor order, ring numbers, reflector
+                     index, plugboard map
+    uint16[period]   table index (l * 676 + m * 26 + r) of each cycle position
+    uint8[period,26] substitution at each cycle position
+
+load() memory maps the arrays, so processes that load the same file share
+the pages and nothing is rebuilt.
+"""
+
+import struct
+
+import numpy as np
+
+from enigma import EnigmaMachine, ALPHABET, odometer
+from rotor import WIRINGS
+
+MAGIC = b"ENIGKS1\0"
+
+# magic, period, order (3), rings (3), reflector, plugboard map (26), padding
+HEADER = struct.Struct("<8sH3B3BB26B21x")
+
+
+class Keystream():
+    """ Cycle positions and substitutions for one key. key is (rotor order,
+    ring numbers, reflector index, plugboard map), the parts of
+    EnigmaMachine.snapshot() other than the offsets. """
+
+    def __init__(self, key, positions, perms):
+        order, rings, reflector, plugboard = key
+        self.key = (tuple(order), tuple(rings), reflector, tuple(plugboard))
+        self.positions = positions
+        self.perms = perms
+        self.period = len(positions)
+        self.notches = (WIRINGS[order[1]].notch_nums[0], WIRINGS[order[2]].notch_nums[0])
+
+        # Cycle index of every table index, -1 for positions off the cycle
+        self.cycle_index = np.full(17576, -1, dtype=np.int32)
+        self.cycle_index[positions] = np.arange(self.period, dtype=np.int32)
+
+        # Compiled tables for presses off the cycle. Made when first needed.
+        self.tables = None
+
+    @staticmethod
+    def machine_key(machine):
+        snap = machine.snapshot()
+        return ((snap[0], snap[1], snap[2]), (snap[3], snap[4], snap[5]), snap[6], snap[10])
+
+    @classmethod
+    def build(cls, machine):
+        """ Keystream for the wiring of machine. The rotor offsets do not matter. """
+        period = machine.period()
+        tables = machine.compile()
+        mid, right = machine.sockets[2], machine.sockets[3]
+
+        # Two presses from AAA are on the cycle, the next period presses go once round it.
+        l, m, r = odometer(0, 0, 0, mid.notch_nums[0], right.notch_nums[0], np.arange(2, period + 2))
+        positions = (l * 676 + m * 26 + r).astype(np.uint16)
+
+        keystream = cls(cls.machine_key(machine), positions, tables.array()[positions])
+        keystream.tables = tables
+        return keystream
+
+    def save(self, path):
+        order, rings, reflector, plugboard = self.key
+        with open(path, "wb") as f:
+            f.write(HEADER.pack(MAGIC, self.period, *order, *rings, reflector, *plugboard))
+            f.write(np.ascontiguousarray(self.positions, dtype="<u2").tobytes())
+            f.write(np.ascontiguousarray(self.perms, dtype=np.uint8).tobytes())
+
+    @classmethod
+    def load(cls, path):
+        """ Memory maps a file written by save(). """
+        with open(path, "rb") as f:
+            header = f.read(HEADER.size)
+        if len(header) != HEADER.size or header[:len(MAGIC)] != MAGIC:
+            raise ValueError("{} is not a keystream file".format(path))
+
+        fields = HEADER.unpack(header)
+        period = fields[1]
+        key = (fields[2:5], fields[5:8], fields[8], fields[9:35])
+        positions = np.memmap(path, dtype="<u2", mode="r", offset=HEADER.size, shape=(period,))
+        perms = np.memmap(path, dtype=np.uint8, mode="r", offset=HEADER.size + 2 * period, shape=(period, 26))
+        return cls(key, positions, perms)
+
+    def matches(self, machine):
+        """ True if machine has the wiring this keystream was built for. """
+        return self.machine_key(machine) == self.key
+
+    def row(self, index):
+        """ Substitution at table index, on the cycle or not. """
+        i = self.cycle_index[index]
+        if i >= 0:
+            return self.perms[i]
+        if self.tables is None:
+            order, rings, reflector, plugboard = self.key
+            machine = EnigmaMachine()
+            machine.restore(order + rings + (reflector, 0, 0, 0, plugboard))
+            self.tables = machine.compile()
+        return np.frombuffer(self.tables.table(index), dtype=np.uint8)
+
+    def encrypt_codes(self, position, codes, block=1 << 20):
+        """ Encrypts a numpy array of letter numbers starting at table index
+        position (the rotors before the first press). Returns (cipher codes,
+        table index after the last press). """
+        n = len(codes)
+        out = np.empty(n, dtype=np.uint8)
+        l, m, r = position // 676, position // 26 % 26, position % 26
+        nm, nr = self.notches
+
+        # Presses before the rotors reach the cycle
+        t = 0
+        while t < n:
+            pl, pm, pr = odometer(l, m, r, nm, nr, t + 1)
+            index = pl * 676 + pm * 26 + pr
+            if self.cycle_index[index] >= 0:
+                break
+            out[t] = self.row(index)[codes[t]]
+            t += 1
+
+        if t < n:
+            first = int(self.cycle_index[index]) - t
+            for i in range(t, n, block):
+                steps = np.arange(i, min(i + block, n))
+                out[i:i + block] = self.perms[(first + steps) % self.period, codes[i:i + block]]
+
+        l, m, r = odometer(l, m, r, nm, nr, n)
+        return out, l * 676 + m * 26 + r
+
+    def encrypt_msg(self, machine, msg):
+        """ Same as machine.encrypt_msg(msg), using the keystream. machine
+        must match this keystream and is left where encrypt_msg would leave it. """
+        if not self.matches(machine):
+            raise ValueError("machine wiring does not match this keystream")
+        if not isinstance(msg, str):
+            raise TypeError("msg must be a string")
+        msg = msg.replace(" ", "")
+        if not msg.isascii():
+            raise ValueError("letter must be uppercase alphabetical character.")
+        codes = np.frombuffer(msg.encode("ascii"), dtype=np.uint8) - 65
+        if len(codes) and codes.max() > 25:
+            raise ValueError("letter must be uppercase alphabetical character.")
+
+        out, position = self.encrypt_codes(machine.position_index(), codes)
+        machine.restore(machine.snapshot()[:7] + (position // 676, position // 26 % 26, position % 26,
+                                                  machine.plugboard_map))
+        return (out + 65).tobytes().decode("ascii")
+
+
+if __name__ == "__main__":
+    import os
+    import random
+    import tempfile
+
+    e = EnigmaMachine()
+    e.set_sockets([2, 5, 3])
+    e.set_reflector("UKW-C")
+    e.set_rotor_ringstellung(2, "K")
+    e.create_plugboard_pair("A", "Q")
+
+    keystream = Keystream.build(e)
+    path = os.path.join(tempfile.mkdtemp(), "key.ks")
+    keystream.save(path)
+    print("Saved {} bytes".format(os.path.getsize(path)))
+    loaded = Keystream.load(path)
+
+    # Compare with the machine from several starts, including ones off the cycle
+    rng = random.Random(0)
+    msg = "".join(rng.choice(ALPHABET) for i in range(40000))
+    ok = True
+    for offsets in ("AAA", "QEV", "AZU", "AZA", "ZZW"):
+        a = EnigmaMachine()
+        b = EnigmaMachine()
+        for m in (a, b):
+            m.restore(e.snapshot()[:7] + tuple(ALPHABET.index(x) for x in offsets) + (e.plugboard_map,))
+        ok = ok and loaded.encrypt_msg(a, msg) == b.encrypt_msg(msg) and a.snapshot() == b.snapshot()
+    print(ok)
@@ -1,24 +1,54 @@
 #!/usr/bin/python3
 
 import logging
+import argparse
+import contextlib
 import enigma
 import cmd
+import io
+import json
 import sys
 
 class UI(cmd.Cmd):
     prompt = '> '
 
-    def __init__(self, file=None):
+    def __init__(self, file=None, batch=False):
         super().__init__()
         self.enigma = enigma.EnigmaMachine()
         self.alphabet = [letter for letter in "ABCDEFGHIJKLMNOPQRSTUVWXYZ"]
         self.output = []
-        print("\nEnigma Machine initialized.   Type help or ? to list commands.")
-        self.display_enigma_state()
+
+        # Batch mode: no banner and no state redraw after each command. See run_script()
+        self.batch = batch
+        self.last_error = None
+        if not batch:
+            print("\nEnigma Machine initialized.   Type help or ? to list commands.")
+            self.display_enigma_state()
     
     def postcmd(self, stop, inp):
-        self.display_enigma_state()
-        self.output = []
+        if not self.batch:
+            self.display_enigma_state()
+            self.output = []
+        return stop
+
+    def error(self, msg):
+        """ Prints an error message and remembers it for run_script(). """
+        self.last_error = msg
+        print(msg)
+
+    def default(self, line):
+        self.error("*** Unknown syntax: {}".format(line))
+
+    def enigma_state(self):
+        """ Rotor names, ringstellung, initial offset, reflector and plugboard. """
+        sockets = [x[1] for x in self.enigma.sockets.items()]
+        return {
+            "rotors": [x.name for x in sockets],
+            "ringstellung": "".join(x.ringstellung for x in sockets),
+            "offsets": "".join(x.rotation_offset for x in sockets),
+            "reflector": self.enigma.reflector.type,
+            "plugboard": ["".join(pair) for pair in self.enigma.plugboard],
+        }
 
     def display_enigma_state(self):
         # get rotor names, ringstellung, initial offset, plugboard
@@ -39,6 +69,51 @@ class UI(cmd.Cmd):
         print("output: {}".format(lamp))
         print("\n")
 
+    def run_script(self, lines, out, json_results=False):
+        """ Runs UI commands from lines, one per line, without redrawing the
+        machine state. Blank lines and lines starting with '#' are skipped.
+        Messages and the output of each 'e' command are written to out, or with
+        json_results one JSON object per command. Returns the number of
+        commands that failed. """
+        failed = 0
+        for number, line in enumerate(lines, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+
+            self.last_error = None
+            self.output = []
+            messages = io.StringIO() if json_results else out
+            with contextlib.redirect_stdout(messages):
+                # A bad line, such as a key the machine rejects, fails on its
+                # own and the rest of the script still runs.
+                try:
+                    stop = self.onecmd(line)
+                except ValueError as err:
+                    self.error("Error: {}".format(err))
+                    stop = False
+            lamp = "".join(self.output)
+
+            if self.last_error is not None:
+                failed += 1
+            if json_results:
+                result = {
+                    "line": number,
+                    "command": line,
+                    "ok": self.last_error is None,
+                    "error": self.last_error,
+                    "messages": messages.getvalue().splitlines(),
+                    "output": lamp.replace(" ", ""),
+                    "state": self.enigma_state(),
+                }
+                out.write(json.dumps(result) + "\n")
+            elif lamp:
+                out.write("output: {}\n".format(lamp))
+
+            if stop:
+                break
+        return failed
+
     def do_e(self, inp):
         """ e: encrypts msg. Usage: 'e enigma' """
 
@@ -48,7 +123,7 @@ class UI(cmd.Cmd):
         
         # converts to string successfully. no numbers, special chars
         if not inp.isalpha():
-            print("Error: input must be alphabetic only")
+            self.error("Error: input must be alphabetic only")
             return
         
         # convert to upper
@@ -82,7 +157,7 @@ class UI(cmd.Cmd):
             self.enigma.reset_plugboard()
         
         else:
-            print("Error: {} is not a proper flag".format(inp))
+            self.error("Error: {} is not a proper flag".format(inp))
         
         
 
@@ -91,7 +166,7 @@ class UI(cmd.Cmd):
         
         # Check for flag
         if len(inp) == 0:
-            print("Error: r must have a flag")
+            self.error("Error: r must have a flag")
             return
         
         args = inp.split(" ")
@@ -100,7 +175,7 @@ class UI(cmd.Cmd):
         flags = ["-a", "-c", "-so", "-sr", "-r"]
         flag = args[0]
         if flag not in flags:
-            print("Error: improper flag. Flags: {}".format(flags))
+            self.error("Error: improper flag. Flags: {}".format(flags))
             return
         
         
@@ -114,7 +189,7 @@ class UI(cmd.Cmd):
         if flag == "-c":
             # r -c [rotor num] [rotor num] [rotor num]: changes rotors used and order placed. Usage 'r -c 2 4 3'
             if len(args) != 4:
-                print("Error: improper number of args. Usage: 'r -c [rotor num] [rotor num] [rotor num]' ")
+                self.error("Error: improper number of args. Usage: 'r -c [rotor num] [rotor num] [rotor num]' ")
                 return
             
             config = args[1:]
@@ -123,14 +198,14 @@ class UI(cmd.Cmd):
             valid_nums = self.enigma.r_table.keys()
             for i in range(len(config)):
                 if not config[i].isnumeric():
-                    print("Error: arguments must be numbers")
+                    self.error("Error: arguments must be numbers")
                     return
                 else:
                     x = config[i]
                     config[i] = int(x)
 
                 if config[i] not in valid_nums:
-                    print("Error: args contain an invalid Rotor Number. Check valid rotor numbers with 'r -a' ")
+                    self.error("Error: args contain an invalid Rotor Number. Check valid rotor numbers with 'r -a' ")
                     return
             
 
@@ -140,7 +215,7 @@ class UI(cmd.Cmd):
         if flag == "-so":
             # 'r -so [rotor position] [initial offset]'
             if len(args) != 3:
-                print("Error: improper number of args. Usage: 'r -so [rotor position] [initial offset]' ")
+                self.error("Error: improper number of args. Usage: 'r -so [rotor position] [initial offset]' ")
                 return
 
             # Check that rotor position is num and valid.
@@ -149,16 +224,16 @@ class UI(cmd.Cmd):
             try:
                 pos = int(pos)
             except:
-                print("Error: rotor position must be a number.")
+                self.error("Error: rotor position must be a number.")
                 return
             if pos not in valid_pos:
-                print("Error: invalid rotor position")
+                self.error("Error: invalid rotor position")
                 return
 
             # Check that initial offset is valid
             offset = args[2]
             if offset not in self.alphabet:
-                print("Error: invalid initial offset. Must be capital letter")
+                self.error("Error: invalid initial offset. Must be capital letter")
                 return
 
             self.enigma.set_rotor_initial_offset(pos, offset)
@@ -168,7 +243,7 @@ class UI(cmd.Cmd):
         if flag == "-sr":
             # 'r -sr [rotor position] [ringstellung]'
             if len(args) != 3:
-                print("Error: improper number of args. Usage: 'r -sr [rotor position] [ringstellung]' ")
+                self.error("Error: improper number of args. Usage: 'r -sr [rotor position] [ringstellung]' ")
                 return
 
             # Check that rotor position is num and valid.
@@ -177,16 +252,16 @@ class UI(cmd.Cmd):
             try:
                 pos = int(pos)
             except:
-                print("Error: rotor position must be a number.")
+                self.error("Error: rotor position must be a number.")
                 return
             if pos not in valid_pos:
-                print("Error: invalid rotor position")
+                self.error("Error: invalid rotor position")
                 return
 
             # Check that ringstellung is valid
             ring = args[2]
             if ring not in self.alphabet:
-                print("Error: invalid ringstellung. Must be capital letter")
+                self.error("Error: invalid ringstellung. Must be capital letter")
                 return
 
             self.enigma.set_rotor_ringstellung(pos, ring)
@@ -195,7 +270,7 @@ class UI(cmd.Cmd):
         if flag == "-r":
             # r -r [rotor position]: resets rotor. Usage: 'r -r 2'
             if len(args) != 2:
-                print("Error: improper number of args. Usage: 'r -r 2' ")
+                self.error("Error: improper number of args. Usage: 'r -r 2' ")
                 return
             
             pos = args[1]
@@ -203,10 +278,10 @@ class UI(cmd.Cmd):
             try:
                 pos = int(pos)
             except:
-                print("Error: rotor position must be a number.")
+                self.error("Error: rotor position must be a number.")
                 return
             if pos not in valid_pos:
-                print("Error: invalid rotor position")
+                self.error("Error: invalid rotor position")
                 return
 
             self.enigma.reset_rotor_settings(pos=pos)
@@ -218,7 +293,7 @@ class UI(cmd.Cmd):
         """ ref: changes reflector used. Usage: 'ref UKW-C' """
         reflector_names = self.enigma.reflectors_available.keys()
         if inp not in reflector_names:
-            print("Invalid reflector name. Reflector Names: {}". format(list(reflector_names)))
+            self.error("Invalid reflector name. Reflector Names: {}". format(list(reflector_names)))
             return
 
         self.enigma.set_reflector(inp)
@@ -228,7 +303,7 @@ class UI(cmd.Cmd):
     def do_p(self, inp):
         """ p: create plugboard pair. Usage: 'p A B' """
         if len(inp) != 3:
-            print("Error: invalid args. Usage: 'p A B' ")
+            self.error("Error: invalid args. Usage: 'p A B' ")
             return
         
         args = inp.split(" ")       
@@ -238,9 +313,13 @@ class UI(cmd.Cmd):
         # Error Check
         for x in tup:
             if x not in self.alphabet:
-                print("Error: arguments must be uppercase letters")
+                self.error("Error: arguments must be uppercase letters")
                 return
 
+        if len(self.enigma.plugboard) == 10:
+            self.error("Error: Plugboard already has maximum of ten pairs.")
+            return
+
         self.enigma.create_plugboard_pair(tup[0], tup[1])
         
 
@@ -249,6 +328,8 @@ class UI(cmd.Cmd):
 
     def do_quit(self, inp):
         print("Shutting down Enigma Machine.")
+        if self.batch:
+            return True
         sys.exit(0)
     
     def do_help(self, inp):
@@ -273,12 +354,114 @@ class UI(cmd.Cmd):
         print("p: create plugboard pair. Usage: 'p A B' ")
     
 
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="M3 Enigma Machine. Interactive unless --stream or --script is given.")
+    parser.add_argument("--trace", action="store_true", help="write every stage of each keypress to main.log")
+    parser.add_argument("--stream", metavar="FILE", help="encrypt FILE ('-' for stdin) without the interactive UI")
+    parser.add_argument("--script", metavar="FILE", help="run UI commands from FILE ('-' for stdin) with no state redraw")
+    parser.add_argument("--json", action="store_true", help="(--script) write one JSON result per command")
+    parser.add_argument("-o", "--output", metavar="FILE", default="-", help="where --stream and --script write ('-' for stdout)")
+    parser.add_argument("--chunk-size", type=int, default=1 << 16, help="bytes read per chunk in --stream mode")
+    parser.add_argument("--rotors", type=int, nargs=3, default=[1, 2, 3], metavar="NUM", help="(--stream) rotor numbers for sockets 1 2 3")
+    parser.add_argument("--ring", default="AAA", help="(--stream) ringstellung of sockets 1 2 3. e.g. 'AKF'")
+    parser.add_argument("--offset", default="AAA", help="(--stream) initial offset of sockets 1 2 3. e.g. 'CAH'")
+    parser.add_argument("--reflector", default="UKW-B", choices=["UKW-B", "UKW-C"], help="(--stream) reflector")
+    parser.add_argument("--plugboard", default="", help="(--stream) plugboard pairs. e.g. 'UA VD'")
+    args = parser.parse_args(argv)
+
+    if args.stream is not None and args.script is not None:
+        parser.error("--stream and --script cannot be used together")
+    if args.chunk_size < 1:
+        parser.error("--chunk-size must be positive")
+    for name in ("ring", "offset"):
+        val = getattr(args, name)
+        if len(val) != 3 or not val.isalpha() or not val.isupper():
+            parser.error("--{} must be three capital letters".format(name))
+    if len(args.plugboard.split()) > 10:
+        parser.error("--plugboard takes at most ten pairs")
+    for pair in args.plugboard.split():
+        if len(pair) != 2 or not pair.isalpha() or not pair.isupper():
+            parser.error("--plugboard pairs must be two capital letters. e.g. 'UA VD'")
+
+    return args
+
+
+def configure(machine, args):
+    """ Applies command line settings to an EnigmaMachine. """
+    pairs = [(pair[0], pair[1]) for pair in args.plugboard.split()]
+    machine.apply(enigma.MachineConfig(args.rotors, args.ring, args.offset, args.reflector, pairs))
+
+
+def stream(args):
+    """ Non-interactive mode. Encrypts a file or stdin in fixed size chunks. """
+    machine = enigma.EnigmaMachine()
+    configure(machine, args)
+    if args.trace:
+        machine.set_trace(enigma.log_trace)
+
+    # File to file goes through memory maps, so size is not limited by RAM
+    if args.stream != "-" and args.output != "-" and not args.trace:
+        machine.encrypt_file(args.stream, args.output, window=max(args.chunk_size, 1 << 20))
+        return
+
+    src = sys.stdin.buffer if args.stream == "-" else open(args.stream, "rb")
+    dst = sys.stdout.buffer if args.output == "-" else open(args.output, "wb")
+    try:
+        machine.encrypt_stream(src, dst, chunk_size=args.chunk_size)
+    finally:
+        if src is not sys.stdin.buffer:
+            src.close()
+        if dst is not sys.stdout.buffer:
+            dst.close()
+
+
+def script(args):
+    """ Batch mode. Runs a file of UI commands. Returns the number that failed. """
+    ui = UI(batch=True)
+    if args.trace:
+        ui.enigma.set_trace(enigma.log_trace)
+
+    src = sys.stdin if args.script == "-" else open(args.script)
+    dst = sys.stdout if args.output == "-" else open(args.output, "w")
+    try:
+        return ui.run_script(src, dst, json_results=args.json)
+    finally:
+        if src is not sys.stdin:
+            src.close()
+        if dst is not sys.stdout:
+            dst.close()
+
+
 if __name__ == "__main__":
+    args = parse_args(sys.argv[1:])
+
     logging.basicConfig(filename='main.log', level=logging.INFO, filemode='w')
     logging.info('Started')
+
+    if args.stream is not None:
+        try:
+            stream(args)
+        except (ValueError, OSError) as err:
+            sys.exit("Error: {}".format(err))
+        logging.info('Finished')
+        sys.exit(0)
+
+    if args.script is not None:
+        try:
+            failed = script(args)
+        except OSError as err:
+            sys.exit("Error: {}".format(err))
+        logging.info('Finished')
+        sys.exit(1 if failed else 0)
     
     # Run the Enigma Machine UI
-    UI().cmdloop()
+    ui = UI()
+
+    # Per keypress trace of every stage goes to main.log only when asked for
+    if args.trace:
+        ui.enigma.set_trace(enigma.log_trace)
+
+    ui.cmdloop()
 
 
     logging.info('Finished')
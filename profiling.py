@@ -0,0 +1,85 @@
+""" Opt-in stage counters and timers for EnigmaMachine.
+
+    profiler = machine.enable_profiling()
+    machine.encrypt_msg(text)
+    profiler.snapshot()
+
+Times are perf_counter_ns deltas summed per stage. With a dump file set,
+a JSON line with the snapshot is written every `every` keypresses.
+"""
+
+import json
+import time
+
+# Stages of step(), in signal order. Compiled mode replaces the wheel and
+# reflector stages by one table_lookup. The numpy paths record one bulk
+# entry per call, counting letters.
+STAGES = ("plugboard_in", "rotate_rotors", "wheel_3", "wheel_2", "wheel_1", "reflector",
+          "wheel_1_back", "wheel_2_back", "wheel_3_back", "plugboard_out", "table_lookup", "bulk")
+
+
+class StageProfiler():
+
+    def __init__(self, dump=None, every=10000):
+        # dump is a text file object for JSON lines, or None
+        if every < 1:
+            raise ValueError("every must be at least 1")
+        self.dump_file = dump
+        self.every = every
+        self.cache = None  # TablesCache of the machine, set by enable_profiling
+        self.reset()
+
+    def reset(self):
+        self.counts = dict.fromkeys(STAGES, 0)
+        self.times = dict.fromkeys(STAGES, 0)
+        self.keypresses = 0
+        self.double_steps = 0
+        self.table_hits = 0
+        self.table_misses = 0
+        self.started = time.time()
+
+    def add(self, stage, ns, count=1):
+        self.counts[stage] += count
+        self.times[stage] += ns
+
+    def tick(self, count=1):
+        """ Counts keypresses and writes a dump line when due. """
+        before = self.keypresses
+        self.keypresses += count
+        if self.dump_file is not None and self.keypresses // self.every != before // self.every:
+            self.dump()
+
+    def snapshot(self):
+        stages = {}
+        for stage in STAGES:
+            count = self.counts[stage]
+            stages[stage] = {
+                "count": count,
+                "total_ns": self.times[stage],
+                "mean_ns": self.times[stage] / count if count else 0.0
+            }
+        snap = {
+            "time": time.time(),
+            "elapsed": time.time() - self.started,
+            "keypresses": self.keypresses,
+            "double_steps": self.double_steps,
+            "table_hits": self.table_hits,
+            "table_misses": self.table_misses,
+            "stages": stages
+        }
+        if self.cache is not None:
+            snap["cache"] = self.cache.stats()
+        return snap
+
+    def dump(self, f=None):
+        """ Writes the snapshot as one JSON line to f, or to the dump file. """
+        f = f if f is not None else self.dump_file
+        f.write(json.dumps(compact(self.snapshot())) + "\n")
+        f.flush()
+
+
+def compact(snap):
+    """ Stages in signal order, unused ones left out, to keep dump lines short. """
+    snap = dict(snap)
+    snap["stages"] = {k: v for k, v in snap["stages"].items() if v["count"]}
+    return snap
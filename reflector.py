@@ -9,6 +9,7 @@ class Reflector():
         # Create contact map for reflector
         self.alphabet_map = [letter for letter in "ABCDEFGHIJKLMNOPQRSTUVWXYZ"]
         self.contact_map = [letter for letter in contact_map]
+        self.contact_nums = tuple(ord(letter) - 65 for letter in self.contact_map)
 
     
     def encrypt(self, letter):
@@ -23,6 +24,13 @@ class Reflector():
         return exit_p
 
 
+# The M3 reflectors, by type. Reflectors do not move, so every machine shares these.
+REFLECTORS = {
+    "UKW-B": Reflector("UKW-B", [letter for letter in "YRUHQSLDPXNGOKMIEBFZCWVJAT"]),
+    "UKW-C": Reflector("UKW-C", [letter for letter in "FVPJIAOYEDRZXWGCTKUQSBNMHL"])
+}
+
+
 if __name__ == "__main__":
 
     logging.basicConfig(filename='reflector.log', level=logging.DEBUG, filemode='w')
@@ -0,0 +1,318 @@
+""" Rejewski's characteristic: a catalog of indicator cycle structures.
+
+Before 1938 each message key was typed twice at the daily ground setting,
+so the first six cipher letters of every message (the indicator) came from
+the same six scrambler permutations A, B, C, D, E, F. Letters 1 and 4 of an
+indicator give one pair of AD, since D(A(x)) is letter 4 when A(x) is letter
+1. With enough messages in a day AD, BE and CF are known completely.
+
+The cycle lengths of AD, BE and CF depend on the rotor order and ground
+setting, but not on the plugboard (it only relabels the letters). Since A
+and D are both involutions with no fixed points, the cycles of AD come in
+pairs of equal length, so half of its cycle lengths form a partition of 13.
+There are 101 of those, so the three together fit in a small integer key.
+
+build() computes the key for every rotor order and start position, with
+ring settings AAA like the original catalog, and stores the positions
+grouped by key. Positions after each press come from odometer(), which
+follows rotate_rotors exactly, double step included. candidates() then
+turns a day's indicators into the keys that fit in one binary search.
+
+File layout (little endian): a header (magic, number of rotor orders,
+number of reflectors, number of patterns, number of entries), the rotor
+orders as 3 bytes each, the reflector indices in REFLECTOR_TYPES, then
+uint32 arrays of pattern keys (sorted), group starts (one more than the
+patterns) and entries (combination * 17576 + position). load() memory maps
+the arrays.
+"""
+
+import itertools
+import multiprocessing
+import os
+import struct
+from collections import namedtuple
+
+import numpy as np
+
+from bombe import clean, scrambler_tables
+from enigma import EnigmaMachine, ALPHABET, REFLECTOR_TYPES, odometer
+
+MAGIC = b"ENIGRJ1\0"
+HEADER = struct.Struct("<8sHBII")
+
+# A possible daily key. position is the ground setting, e.g. "QDK".
+Candidate = namedtuple("Candidate", ["rotors", "reflector", "position"])
+
+
+def partitions(n, largest=None):
+    """ Partitions of n as tuples of parts, largest part first. """
+    if largest is None:
+        largest = n
+    if n == 0:
+        return [()]
+    out = []
+    for part in range(min(n, largest), 0, -1):
+        for rest in partitions(n - part, part):
+            out.append((part,) + rest)
+    return out
+
+
+# Every possible half cycle structure of AD, BE or CF
+PARTITIONS = partitions(13)
+
+
+def partition_code(pairs):
+    """ Mixed radix code of a partition given as counts of parts of length
+    1 to 13 along the last axis. Works on numpy arrays. """
+    code = 0
+    for length in range(13, 0, -1):
+        code = code * 14 + pairs[..., length - 1]
+    return code
+
+
+PARTITION_CODES = np.array(sorted(partition_code(np.bincount(p, minlength=14)[1:]) for p in PARTITIONS),
+                           dtype=np.int64)
+
+
+def partition_of(code):
+    """ Partition for a code from partition_code. """
+    counts = []
+    for length in range(1, 14):
+        counts.append(code % 14)
+        code //= 14
+    return tuple(length for length in range(13, 0, -1) for i in range(counts[length - 1]))
+
+
+def half_structure(perm):
+    """ Pair counts by cycle length (1 to 13) of each row of perm, a (rows, 26)
+    array of permutations whose cycles come in equal length pairs. """
+    rows = np.arange(len(perm))[:, None]
+    identity = np.arange(26)[None, :]
+    lengths = np.zeros(perm.shape, dtype=np.int64)
+    cur = perm
+    for k in range(1, 27):
+        lengths[(cur == identity) & (lengths == 0)] = k
+        cur = perm[rows, cur]
+    return np.stack([(lengths == length).sum(axis=1) // (2 * length) for length in range(1, 14)], axis=-1)
+
+
+def pattern_key(structures):
+    """ One integer for the half structures of AD, BE and CF (three arrays
+    from half_structure). Each partition is numbered 0 to 100. """
+    key = 0
+    for pairs in structures:
+        key = key * len(PARTITIONS) + np.searchsorted(PARTITION_CODES, partition_code(pairs))
+    return key
+
+
+def pattern_of(key):
+    """ Cycle lengths of AD, BE and CF (each as a full list, pairs included) for a key. """
+    ids = []
+    for i in range(3):
+        ids.append(int(key) % len(PARTITIONS))
+        key //= len(PARTITIONS)
+    out = []
+    for i in reversed(ids):
+        half = partition_of(int(PARTITION_CODES[i]))
+        out.append(tuple(x for x in half for j in range(2)))
+    return tuple(out)
+
+
+def order_keys(job):
+    """ Pattern key of every start position for one (rotor order, reflector).
+    Process pool worker for build(). """
+    order, reflector = job
+    machine, table = scrambler_tables(order, reflector)
+    notches = (machine.sockets[2].notch_nums[0], machine.sockets[3].notch_nums[0])
+
+    starts = np.arange(17576)[:, None]
+    l, m, r = odometer(starts // 676, starts // 26 % 26, starts % 26, notches[0], notches[1],
+                       np.arange(1, 7)[None, :])
+    index = l * 676 + m * 26 + r
+    perms = [table[index[:, k]].astype(np.intp) for k in range(6)]
+
+    rows = np.arange(17576)[:, None]
+    structures = [half_structure(perms[k + 3][rows, perms[k]]) for k in range(3)]
+    return pattern_key(structures).astype(np.uint32)
+
+
+class Catalog():
+    """ Start positions grouped by the cycle structure of AD, BE and CF. """
+
+    def __init__(self, orders, reflectors, patterns, starts, entries):
+        self.orders = [tuple(order) for order in orders]
+        self.reflectors = list(reflectors)
+        self.patterns = patterns
+        self.starts = starts
+        self.entries = entries
+
+    @classmethod
+    def build(cls, orders=None, reflectors=("UKW-B",), processes=None, pool=None):
+        """ Catalogs every start position of every rotor order (all 60 orders
+        of three from r_table by default) and reflector. The orders are spread
+        over processes workers, or over pool if given. """
+        if orders is None:
+            orders = list(itertools.permutations(EnigmaMachine().r_table.keys(), 3))
+        for name in reflectors:
+            if name not in REFLECTOR_TYPES:
+                raise ValueError("reflector must be either 'UKW-B' or 'UKW-C'")
+        jobs = [(tuple(order), name) for order in orders for name in reflectors]
+
+        if processes is None:
+            processes = os.cpu_count() or 1
+        if pool is not None:
+            keys = pool.map(order_keys, jobs)
+        elif processes == 1:
+            keys = [order_keys(job) for job in jobs]
+        else:
+            with multiprocessing.Pool(processes) as new_pool:
+                keys = new_pool.map(order_keys, jobs)
+
+        # Combination c covers jobs[c], entries are c * 17576 + start position
+        keys = np.concatenate(keys)
+        entries = np.argsort(keys, kind="stable").astype(np.uint32)
+        patterns, counts = np.unique(keys[entries], return_counts=True)
+        starts = np.concatenate(([0], np.cumsum(counts))).astype(np.uint32)
+
+        return cls([job[0] for job in jobs[::len(reflectors)]], reflectors, patterns, starts, entries)
+
+    def combination(self, c):
+        """ (rotor order, reflector) for combination number c. """
+        return self.orders[c // len(self.reflectors)], self.reflectors[c % len(self.reflectors)]
+
+    def save(self, path):
+        with open(path, "wb") as f:
+            f.write(HEADER.pack(MAGIC, len(self.orders), len(self.reflectors), len(self.patterns), len(self.entries)))
+            f.write(bytes(x for order in self.orders for x in order))
+            f.write(bytes(REFLECTOR_TYPES.index(name) for name in self.reflectors))
+            for array in (self.patterns, self.starts, self.entries):
+                f.write(np.ascontiguousarray(array, dtype="<u4").tobytes())
+
+    @classmethod
+    def load(cls, path):
+        """ Memory maps a catalog written by save(). """
+        with open(path, "rb") as f:
+            header = f.read(HEADER.size)
+            if len(header) != HEADER.size or header[:len(MAGIC)] != MAGIC:
+                raise ValueError("{} is not a catalog file".format(path))
+            magic, n_orders, n_reflectors, n_patterns, n_entries = HEADER.unpack(header)
+            raw = f.read(3 * n_orders + n_reflectors)
+
+        orders = [tuple(raw[3 * i:3 * i + 3]) for i in range(n_orders)]
+        reflectors = [REFLECTOR_TYPES[x] for x in raw[3 * n_orders:]]
+        offset = HEADER.size + len(raw)
+        arrays = []
+        for count in (n_patterns, n_patterns + 1, n_entries):
+            arrays.append(np.memmap(path, dtype="<u4", mode="r", offset=offset, shape=(count,)))
+            offset += 4 * count
+        return cls(orders, reflectors, *arrays)
+
+    def lookup(self, key):
+        """ Candidates with pattern key. """
+        i = int(np.searchsorted(self.patterns, key))
+        if i == len(self.patterns) or self.patterns[i] != key:
+            return []
+        out = []
+        for entry in self.entries[self.starts[i]:self.starts[i + 1]]:
+            c, start = divmod(int(entry), 17576)
+            order, reflector = self.combination(c)
+            out.append(Candidate(order, reflector, ALPHABET[start // 676] + ALPHABET[start // 26 % 26] + ALPHABET[start % 26]))
+        return out
+
+    def candidates(self, indicators):
+        """ Daily keys (rotor order, reflector, ground setting with rings AAA)
+        that fit a day's six letter indicators. """
+        return self.lookup(indicator_key(indicators))
+
+
+def indicator_permutations(indicators):
+    """ AD, BE and CF as lists of letter numbers from six letter indicators.
+    Raises ValueError if they are not fully determined or contradict each other. """
+    perms = [[None] * 26 for i in range(3)]
+    for indicator in indicators:
+        indicator = clean(indicator)
+        if len(indicator) != 6:
+            raise ValueError("indicators must be 6 letters")
+        for k in range(3):
+            a, b = ord(indicator[k]) - 65, ord(indicator[k + 3]) - 65
+            if perms[k][a] not in (None, b):
+                raise ValueError("indicators disagree about {}".format(("AD", "BE", "CF")[k]))
+            perms[k][a] = b
+
+    for k in range(3):
+        missing = [ALPHABET[i] for i in range(26) if perms[k][i] is None]
+        if missing:
+            raise ValueError("{} is not complete. No indicator starts with {} in position {}".format(
+                ("AD", "BE", "CF")[k], "".join(missing), k + 1))
+        if sorted(perms[k]) != list(range(26)):
+            raise ValueError("indicators do not give a permutation for {}".format(("AD", "BE", "CF")[k]))
+    return perms
+
+
+def indicator_key(indicators):
+    """ Pattern key of a day's indicators. """
+    structures = [half_structure(np.array([perm])) for perm in indicator_permutations(indicators)]
+    for k in range(3):
+        if (structures[k][0] * 2 * np.arange(1, 14)).sum() != 26:
+            raise ValueError("cycles of {} do not come in pairs, so the indicators are not from one ground setting".format(
+                ("AD", "BE", "CF")[k]))
+    return int(pattern_key(structures)[0])
+
+
+if __name__ == "__main__":
+    import random
+    import tempfile
+    import time
+
+    # Exact stepping check: AD from a machine stepped by rotate_rotors
+    # against the catalog worker, including starts that double step.
+    order = (2, 5, 3)
+    keys = order_keys((order, "UKW-B"))
+    ok = True
+    for start in ("AAA", "ADU", "AEV", "QEV", "ZZZ", "BDT"):
+        e = EnigmaMachine()
+        e.set_sockets(list(order))
+        for i in range(3):
+            e.set_rotor_initial_offset(i + 1, start[i])
+        table = e.compile()
+        perms = []
+        for k in range(6):
+            e.rotate_rotors()
+            perms.append(list(table.table(e.position_index())))
+        structures = [half_structure(np.array([[perms[k + 3][perms[k][x]] for x in range(26)]])) for k in range(3)]
+        index = (ord(start[0]) - 65) * 676 + (ord(start[1]) - 65) * 26 + ord(start[2]) - 65
+        ok = ok and int(pattern_key(structures)[0]) == int(keys[index])
+    print("Stepping check:", ok)
+
+    begin = time.time()
+    catalog = Catalog.build()
+    print("Built {} entries, {} patterns in {:.1f}s".format(len(catalog.entries), len(catalog.patterns), time.time() - begin))
+    path = os.path.join(tempfile.mkdtemp(), "catalog.rj")
+    catalog.save(path)
+    print("Saved {} bytes".format(os.path.getsize(path)))
+    catalog = Catalog.load(path)
+
+    # A day of traffic: each operator types a random message key twice at the ground setting
+    e = EnigmaMachine()
+    e.set_sockets([4, 1, 3])
+    for pair in ("AQ", "BJ", "CX", "EM", "GT", "HZ"):
+        e.create_plugboard_pair(pair[0], pair[1])
+    rng = random.Random(7)
+    indicators = []
+    while True:
+        for i in range(3):
+            e.set_rotor_initial_offset(i + 1, "KDQ"[i])
+        key = "".join(rng.choice(ALPHABET) for i in range(3))
+        indicators.append(e.encrypt_msg(key + key))
+        try:
+            indicator_permutations(indicators)
+            break
+        except ValueError:
+            continue
+
+    begin = time.time()
+    found = catalog.candidates(indicators)
+    print("{} indicators, looked up in {:.1f}ms".format(len(indicators), (time.time() - begin) * 1000))
+    print(pattern_of(indicator_key(indicators)))
+    print(len(found), "candidates")
+    print(Candidate((4, 1, 3), "UKW-B", "KDQ") in found)
@@ -1,133 +1,166 @@
-from copy import deepcopy
+from collections import namedtuple
 
-class Rotor():
+ALPHABET = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
 
-    def __init__(self, name, wiring_map, notches):
+# Letters as a tuple, for membership tests that must not match substrings.
+LETTERS = tuple(ALPHABET)
 
-        # Alphabet map
-        self.a = [letter for letter in "ABCDEFGHIJKLMNOPQRSTUVWXYZ"]
+# Letter to number (0-25) lookup. Doubles as validation for single letters.
+LETTER_NUMS = {letter: i for i, letter in enumerate(ALPHABET)}
 
-        self.name = name # I, II, III, etc...
-        self.ringstellung = "A"
-        self.rotation_offset = "A" 
-        self.notches = notches
 
-        # Create representation of internal wiring / rotor's inner core
-        self.right = [letter for letter in "ABCDEFGHIJKLMNOPQRSTUVWXYZ"]
-        self.left = [None for x in range(26)]
-        
+class Wiring(namedtuple("Wiring", ["name", "notches", "forward", "inverse", "notch_nums"])):
+    """ Immutable wiring of one rotor type. Shared by every Rotor of that type.
+    forward[i] is the contact hit when entering at contact i (right to left),
+    inverse[j] is the contact hit when entering at contact j (left to right). """
+    __slots__ = ()
 
-        # Create left from map
-        for letter in wiring_map:
-            i = wiring_map.index(letter) # 0
-            let = self.a[i] # A
-            j = self.let_to_num(letter) # 4
-            self.left[j] = let
+    @classmethod
+    def from_letters(cls, name, wiring_map, notches):
+        for letter in list(wiring_map) + list(notches):
+            if letter not in LETTERS:
+                raise ValueError("wiring and notches must be uppercase alphabetical characters.")
+        forward = tuple(ord(letter) - 65 for letter in wiring_map)
+        if sorted(forward) != list(range(26)):
+            raise ValueError("wiring_map must use every letter once")
+        inverse = [None for x in range(26)]
+        for i in range(26):
+            inverse[forward[i]] = i
+        return cls(name, tuple(notches), forward, tuple(inverse), tuple(ord(letter) - 65 for letter in notches))
 
-        
-        # Save initial settings for rotor
-        self.right_initial = deepcopy(self.right)
-        self.left_initial = deepcopy(self.left)
 
-        # Print rotor internals
-        #self.print_internals()
+# The five M3 rotors, by rotor number.
+WIRINGS = {
+    1: Wiring.from_letters("I", "EKMFLGDQVZNTOWYHXUSPAIBRCJ", "Q"),
+    2: Wiring.from_letters("II", "AJDKSIRUXBLHWTMCQGZNPYFVOE", "E"),
+    3: Wiring.from_letters("III", "BDFHJLCPRTXVZNYEIWGAKMUSQO", "V"),
+    4: Wiring.from_letters("IV", "ESOVPZJAYQUIRHXLNFTGKDCMWB", "J"),
+    5: Wiring.from_letters("V", "VZBRGITYUPSDNHLXAWMJQOFECK", "Z"),
+}
+
+
+class Rotor():
+    """ One rotor in a machine: a shared Wiring plus this rotor's ring
+    setting and rotation offset, kept as numbers 0-25. """
+    __slots__ = ("wiring", "ring", "offset")
+
+    # Alphabet map
+    a = LETTERS
+
+    def __init__(self, name, wiring_map=None, notches=None):
+        # Rotor(wiring) shares a Wiring, for example one from WIRINGS.
+        # Rotor(name, wiring_map, notches) builds its own from letters.
+        if wiring_map is None and notches is None:
+            if not isinstance(name, Wiring):
+                raise TypeError("Rotor takes a Wiring, or name, wiring_map and notches")
+            self.wiring = name
+        elif wiring_map is None or notches is None:
+            raise TypeError("Rotor needs both wiring_map and notches")
+        else:
+            self.wiring = Wiring.from_letters(name, wiring_map, notches)
+        self.ring = 0
+        self.offset = 0
+
+    @property
+    def name(self):
+        return self.wiring.name # I, II, III, etc...
+
+    @property
+    def notches(self):
+        return self.wiring.notches
+
+    @property
+    def forward(self):
+        return self.wiring.forward
+
+    @property
+    def inverse(self):
+        return self.wiring.inverse
+
+    @property
+    def notch_nums(self):
+        return self.wiring.notch_nums
+
+    @property
+    def ringstellung(self):
+        return ALPHABET[self.ring]
+
+    @property
+    def rotation_offset(self):
+        return ALPHABET[self.offset]
+
+    @property
+    def shift(self):
+        """ Net displacement of the inner core. Offset moves it up, ring setting moves it down. """
+        return (self.offset - self.ring) % 26
 
-    
     def print_internals(self):
         print(self.name, "ring setting:", self.ringstellung,"rotation_offset:", self.rotation_offset)
-        for letter in self.a:
-            i = self.a.index(letter)
-            print(letter, self.left[i], self.right[i], letter)
+        s = self.shift
+        for i in range(26):
+            # letter on right contact i is wired to the left contact showing that letter
+            right = ALPHABET[(i + s) % 26]
+            left = ALPHABET[self.inverse[(i + s) % 26]]
+            print(ALPHABET[i], left, right, ALPHABET[i])
 
     def let_to_num(self, letter):
-        alphabet = [let for let in "ABCDEFGHIJKLMNOPQRSTUVWXYZ"]
-        if letter not in alphabet:
+        if not isinstance(letter, str) or len(letter) != 1 or letter not in ALPHABET:
             raise ValueError("letter must be alphabetical and uppercase. e.g. 'A'")
 
-        return alphabet.index(letter)
+        return ord(letter) - 65
 
     def rotate(self):
-        i = self.a.index(self.rotation_offset)
-        j = (i+1) % 26
-        self.rotation_offset = self.a[j]
+        self.offset = (self.offset + 1) % 26
 
-        # Rotate rotor's inner core up / left by one
-        self.right = self.right[1:] + self.right[:1]
-        self.left = self.left[1:] + self.left[:1]
-
-         
     def set_ringstellung(self, letter):
-        """
-        self.reset()
-
-        # Rotate inner core down / right
-        num = self.a.index(letter)
-        self.right = self.right[-num:] + self.right[:-num]
-        self.left = self.left[-num:] + self.left[:-num]
-
-        self.ringstellung = letter
-        """
-        while letter != self.ringstellung:
-            # Rotate inner core down/ right
-            self.right = self.right[-1:] + self.right[:-1]
-            self.left = self.left[-1:] + self.left[:-1]
-
-            index = self.a.index(self.ringstellung) # if ringstellung is 'A',
-            self.ringstellung = self.a[index + 1]   # then now it's 'B'
-
+        self.ring = self.let_to_num(letter)
 
     def reset(self):
-        self.ringstellung = "A"
-        self.rotation_offset = "A" # Being safe
+        self.ring = 0
+        self.offset = 0
+
+    def encrypt_num(self, i):
+        """ Right to left pass for contact number i. """
+        s = (self.offset - self.ring) % 26
+        return (self.wiring.forward[(i + s) % 26] - s) % 26
 
-        self.right = deepcopy(self.right_initial)
-        self.left = deepcopy(self.left_initial)
+    def backwards_encrypt_num(self, i):
+        """ Left to right pass for contact number i. """
+        s = (self.offset - self.ring) % 26
+        return (self.wiring.inverse[(i + s) % 26] - s) % 26
 
-    
     def encrypt(self, let):
-        if let not in self.a:
+        try:
+            i = LETTER_NUMS[let]
+        except (KeyError, TypeError):
             raise ValueError("letter must be uppercase alphabetical character.")
 
         # Ex: encrypt 'A'. Rotor I. Ring setting 'B'. Offset 'A'
-        i = self.a.index(let) # 0
-        
-        r = self.right[i] # Z
-
-        j = self.left.index(r) # 10
-
-        out = self.a[j] # K
-
-        return out
+        # shift is 25, forward[25] is 'J' (9), 9 - 25 is 10 -> 'K'
+        return ALPHABET[self.encrypt_num(i)]
 
 
     def backwards_encrypt(self, let):
-        if let not in self.a:
+        try:
+            i = LETTER_NUMS[let]
+        except (KeyError, TypeError):
             raise ValueError("letter must be uppercase alphabetical character.")
 
         # Ex: encrypt 'C'. Rotor I. Ring setting 'A'. Offset 'C'
-        i = self.a.index(let) # 2
-
-        l = self.left[i] # A
-
-        j = self.right.index(l) # 24
-
-        out = self.a[j] # Y
-
-        return out
+        # shift is 2, inverse[4] is 'A' (0), 0 - 2 is 24 -> 'Y'
+        return ALPHABET[self.backwards_encrypt_num(i)]
 
 
     def set_initial_offset(self, let):
         if let not in self.a:
             raise ValueError("let has to be uppercase alphabetic character.")
-        
-        # Rotor could be out of inital offset position.
-        while self.rotation_offset != let:
-            self.rotate()
+
+        self.offset = self.let_to_num(let)
         
 
 if __name__ == "__main__":
     # Create rotor I
-    I = Rotor("I.", [letter for letter in "EKMFLGDQVZNTOWYHXUSPAIBRCJ"], ["Q"])
+    I = Rotor(WIRINGS[1])
 
     # General rotor method tests:
     # Test rotating 27 times
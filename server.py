@@ -0,0 +1,342 @@
+""" Local encryption service. Runs EnigmaMachine sessions behind an asyncio
+TCP or Unix socket so tools do not pay process startup per request.
+
+Every request is one line of JSON. Each connection is a session with its own
+machine, taken from a shared pool, that keeps its rotor positions between
+requests like the interactive UI does.
+
+    {"op": "configure", "rotors": [3, 5, 1], "ringstellung": "AKF",
+     "offsets": "CAH", "reflector": "UKW-C", "plugboard": ["UA", "VD"]}
+    {"op": "encrypt", "length": 11}      followed by 11 bytes of payload
+    {"op": "decrypt", "length": 11}      same as encrypt, Enigma is its own inverse
+    {"op": "reset"}                      back to the configured start position
+    {"op": "stats"}
+
+Replies are one JSON line with "ok" true or false ("error" says why). For
+encrypt and decrypt the reply line gives the length, then that many bytes of
+output follow (letters encrypted and uppercased, other bytes copied, as in
+encrypt_chunk), then a second line with the request's latency and throughput.
+Payloads are read and written a chunk at a time and each chunk waits for the
+client to take the previous one, so memory per session stays bounded.
+
+    python server.py --port 8765
+    python server.py --unix /tmp/enigma.sock
+    python server.py --check             round trip self-check, no port needed
+"""
+
+import argparse
+import asyncio
+import json
+import time
+
+from enigma import EnigmaMachine, MachineConfig
+
+# Longest request line read, in bytes. Payloads are not lines and are not limited.
+LINE_LIMIT = 1 << 16
+
+
+class MachinePool():
+    """ Idle machines kept for reuse. Machines are cheap to build, but reusing
+    them keeps their compiled tables and skips setup. At most size are kept. """
+
+    def __init__(self, size=64):
+        self.size = size
+        self.idle = []
+        self.created = 0
+        self.reused = 0
+
+    def acquire(self):
+        if self.idle:
+            self.reused += 1
+            return self.idle.pop()
+        self.created += 1
+        return EnigmaMachine()
+
+    def release(self, machine):
+        """ Puts machine back in its default key and keeps it if there is room. """
+        if len(self.idle) >= self.size:
+            return
+        machine.set_trace(None)
+        machine.disable_profiling()
+        machine.apply(MachineConfig())
+        self.idle.append(machine)
+
+    def stats(self):
+        return {"idle": len(self.idle), "created": self.created, "reused": self.reused}
+
+
+class Metrics():
+    """ Count, latency and byte totals per operation. """
+
+    def __init__(self):
+        self.ops = {}
+
+    def add(self, op, seconds, nbytes=0):
+        entry = self.ops.setdefault(op, {"count": 0, "seconds": 0.0, "max_seconds": 0.0, "bytes": 0})
+        entry["count"] += 1
+        entry["seconds"] += seconds
+        entry["max_seconds"] = max(entry["max_seconds"], seconds)
+        entry["bytes"] += nbytes
+
+    def snapshot(self):
+        out = {}
+        for op, entry in self.ops.items():
+            out[op] = dict(entry,
+                           mean_seconds=entry["seconds"] / entry["count"],
+                           bytes_per_second=entry["bytes"] / entry["seconds"] if entry["seconds"] else 0.0)
+        return out
+
+
+class Session():
+    """ One connection: a machine and the snapshot of its configured key. """
+
+    def __init__(self, machine):
+        self.machine = machine
+        self.start = machine.snapshot()
+        self.requests = 0
+
+
+class Server():
+    def __init__(self, pool_size=64, chunk_size=1 << 16):
+        if chunk_size < 1:
+            raise ValueError("chunk_size must be positive")
+        self.pool = MachinePool(pool_size)
+        self.metrics = Metrics()
+        self.chunk_size = chunk_size
+        self.sessions = 0
+        self.started = time.monotonic()
+
+    async def send(self, writer, reply):
+        writer.write(json.dumps(reply).encode("utf-8") + b"\n")
+        await writer.drain()
+
+    async def handle(self, reader, writer):
+        """ Serves one connection until the client closes it. """
+        session = Session(self.pool.acquire())
+        self.sessions += 1
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    # Over LINE_LIMIT. The rest of the line cannot be told apart
+                    # from the next request, so the session ends here.
+                    await self.send(writer, {"ok": False, "error": "bad request: line longer than {} bytes"
+                                                                   .format(LINE_LIMIT)})
+                    break
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                    if not isinstance(request, dict):
+                        raise ValueError("request must be a JSON object")
+                except ValueError as err:
+                    await self.send(writer, {"ok": False, "error": "bad request: {}".format(err)})
+                    continue
+
+                session.requests += 1
+                op = request.get("op")
+                start = time.perf_counter()
+                try:
+                    if op in ("encrypt", "decrypt"):
+                        nbytes = await self.encrypt(session, request, reader, writer)
+                    else:
+                        nbytes = 0
+                        await self.send(writer, self.control(session, op, request))
+                except (ValueError, TypeError) as err:
+                    await self.send(writer, {"ok": False, "error": str(err)})
+                    continue
+                self.metrics.add(op, time.perf_counter() - start, nbytes)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.pool.release(session.machine)
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+            finally:
+                # The session counts until its connection is fully closed
+                self.sessions -= 1
+
+    def control(self, session, op, request):
+        """ Reply for the operations that carry no payload. """
+        machine = session.machine
+        if op == "configure":
+            plugboard = request.get("plugboard", ())
+            if isinstance(plugboard, str):
+                plugboard = plugboard.split()
+            machine.apply(MachineConfig(request.get("rotors", (1, 2, 3)),
+                                        request.get("ringstellung", "AAA"),
+                                        request.get("offsets", "AAA"),
+                                        request.get("reflector", "UKW-B"),
+                                        plugboard))
+            session.start = machine.snapshot()
+            return {"ok": True, "config": MachineConfig.from_machine(machine)._asdict()}
+        if op == "reset":
+            machine.restore(session.start)
+            return {"ok": True}
+        if op == "stats":
+            return {"ok": True,
+                    "uptime": time.monotonic() - self.started,
+                    "sessions": self.sessions,
+                    "session_requests": session.requests,
+                    "pool": self.pool.stats(),
+                    "ops": self.metrics.snapshot()}
+        raise ValueError("unknown op {!r}. Use configure, encrypt, decrypt, reset or stats".format(op))
+
+    async def encrypt(self, session, request, reader, writer):
+        """ Streams length payload bytes through the session's machine. """
+        length = request.get("length")
+        if not isinstance(length, int) or isinstance(length, bool) or length < 0:
+            raise ValueError("length must be a non-negative integer")
+
+        start = time.perf_counter()
+        await self.send(writer, {"ok": True, "length": length})
+        remaining = length
+        while remaining:
+            chunk = await reader.readexactly(min(self.chunk_size, remaining))
+            remaining -= len(chunk)
+            writer.write(session.machine.encrypt_chunk(chunk))
+            await writer.drain()
+
+        took = time.perf_counter() - start
+        await self.send(writer, {"ok": True, "seconds": took,
+                                 "bytes_per_second": length / took if took else 0.0})
+        return length
+
+    async def serve(self, host="127.0.0.1", port=8765, unix=None):
+        if unix is not None:
+            server = await asyncio.start_unix_server(self.handle, unix, limit=LINE_LIMIT)
+        else:
+            server = await asyncio.start_server(self.handle, host, port, limit=LINE_LIMIT)
+        async with server:
+            await server.serve_forever()
+
+
+class Client():
+    """ Minimal asyncio client for the protocol above. """
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+
+    @classmethod
+    async def connect(cls, host="127.0.0.1", port=8765, unix=None):
+        if unix is not None:
+            reader, writer = await asyncio.open_unix_connection(unix)
+        else:
+            reader, writer = await asyncio.open_connection(host, port)
+        return cls(reader, writer)
+
+    async def reply(self):
+        reply = json.loads(await self.reader.readline())
+        if not reply["ok"]:
+            raise ValueError(reply["error"])
+        return reply
+
+    async def request(self, op, **fields):
+        self.writer.write(json.dumps(dict(fields, op=op)).encode("utf-8") + b"\n")
+        return await self.reply()
+
+    async def encrypt(self, data, op="encrypt"):
+        """ Sends data and returns (output bytes, trailer reply). """
+        data = bytes(data)
+        self.writer.write(json.dumps({"op": op, "length": len(data)}).encode("utf-8") + b"\n")
+
+        # Send and receive at the same time. The server only reads ahead one
+        # chunk, so writing everything before reading would stall on big payloads.
+        async def send():
+            for i in range(0, len(data), 1 << 16):
+                self.writer.write(data[i:i + (1 << 16)])
+                await self.writer.drain()
+
+        async def receive():
+            header = await self.reply()
+            return await self.reader.readexactly(header["length"])
+
+        sent, out = await asyncio.gather(send(), receive())
+        return out, await self.reply()
+
+    async def decrypt(self, data):
+        return await self.encrypt(data, op="decrypt")
+
+    async def close(self):
+        self.writer.close()
+        await self.writer.wait_closed()
+
+
+if __name__ == "__main__":
+    import os
+    import tempfile
+
+    async def check():
+        """ configure, encrypt, reset, decrypt and one bad request against a
+        server on a temporary Unix socket in this process. """
+        path = os.path.join(tempfile.mkdtemp(), "enigma.sock")
+        server = Server(pool_size=2, chunk_size=4)
+        listener = await asyncio.start_unix_server(server.handle, path, limit=LINE_LIMIT)
+        client = await Client.connect(unix=path)
+
+        config = MachineConfig((3, 5, 1), "AKF", "CAH", "UKW-C", (("U", "A"), ("V", "D")))
+        reply = await client.request("configure", rotors=[3, 5, 1], ringstellung="AKF",
+                                     offsets="CAH", reflector="UKW-C", plugboard="UA VD")
+        print(reply["config"])
+
+        data = b"Hello, world. Attack at dawn!"
+        reference = EnigmaMachine()
+        reference.apply(config)
+        out, trailer = await client.encrypt(data)
+        print(out)
+        print(out == reference.encrypt_chunk(data))
+
+        await client.request("reset")
+        back, trailer = await client.decrypt(out)
+        print(back == data.upper())
+
+        try:
+            await client.request("configure", rotors=[1, 1, 2])
+            print(False)
+        except ValueError as err:
+            print("Rejected: {}".format(err))
+
+        stats = await client.request("stats")
+        print(stats["session_requests"] == 6 and stats["ops"]["encrypt"]["bytes"] == len(data))
+
+        await client.close()
+
+        # A request line over the limit gets an error and ends the session
+        client = await Client.connect(unix=path)
+        client.writer.write(b"x" * (LINE_LIMIT + 1) + b"\n")
+        try:
+            await client.reply()
+            print(False)
+        except ValueError as err:
+            print("Rejected: {}".format(err))
+        print(await client.reader.read() == b"")
+        await client.close()
+
+        while server.sessions:
+            await asyncio.sleep(0.01)
+        listener.close()
+        await listener.wait_closed()
+
+    parser = argparse.ArgumentParser(description="Enigma encryption service")
+    parser.add_argument("--host", default="127.0.0.1", help="TCP address to listen on (default 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=8765, help="TCP port (default 8765)")
+    parser.add_argument("--unix", metavar="PATH", help="listen on a Unix socket instead of TCP")
+    parser.add_argument("--pool-size", type=int, default=64, help="idle machines kept for reuse")
+    parser.add_argument("--chunk-size", type=int, default=1 << 16, help="payload bytes processed per step")
+    parser.add_argument("--check", action="store_true", help="run a round trip self-check and exit")
+    args = parser.parse_args()
+
+    if args.check:
+        asyncio.run(check())
+        raise SystemExit
+
+    server = Server(args.pool_size, args.chunk_size)
+    try:
+        asyncio.run(server.serve(args.host, args.port, args.unix))
+    except KeyboardInterrupt:
+        pass